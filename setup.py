@@ -6,7 +6,7 @@ setup(
     packages=find_packages(where="src"),
     package_dir={"": "src"},
     package_data={
-        "geocam.dependencies":['*'],
+        "geocam.dependencies":['*.whl', '*.tar.gz'],
         "server": [
             "frontend/*",
             "frontend/**/*",
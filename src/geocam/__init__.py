@@ -1,2 +1,9 @@
 from geocam import log
+from geocam import connections
+from geocam import scheduler
+from geocam import protocol
+from geocam import probe
+from geocam import cache
+from geocam import agent
+from geocam import receiver
 from geocam import controller
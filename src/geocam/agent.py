@@ -0,0 +1,135 @@
+"""
+
+Camera agent module for geocam.
+
+The camera control script, the geocam modules it shares with the controller
+and its pure-Python dependencies are packed into a single executable zipapp that runs with the system python3 on the
+Raspberry Pi, so no packages need to be installed on the camera.
+
+"""
+from geocam.cache import CACHE_DIRECTORY
+import hashlib
+import logging
+import os
+import tarfile
+import threading
+import zipfile
+
+log = logging.getLogger(__name__)
+
+AGENT_DIRECTORY = os.path.join(CACHE_DIRECTORY, "agents")
+SHEBANG = b"#!/usr/bin/env python3\n"
+TIMESTAMP = (1980, 1, 1, 0, 0, 0)  # Fixed so that identical inputs give identical archives.
+
+_lock = threading.Lock()
+
+
+def agent_name(script, dependencies: list, modules: list=()) -> str:
+    """
+
+    Return the versioned file name of the agent built from the inputs.
+
+    Parameters
+    ----------
+    script : importlib.abc.Traversable or str
+        Camera control script run as the archive entry point.
+    dependencies : list
+        Wheels and source distributions of the pure-Python dependencies.
+    modules : list
+        Modules imported by the script, added at the top level of the archive.
+
+    Returns
+    -------
+    str
+        File name of the form geocam-agent-<hash>.pyz.
+
+    """
+    digest = hashlib.sha256()
+    for f in [script] + sorted(modules, key=_basename) + sorted(dependencies, key=_basename):
+        digest.update(_basename(f).encode())
+        digest.update(hashlib.sha256(_read(f)).digest())
+    return "geocam-agent-{hash}.pyz".format(hash=digest.hexdigest()[:16])
+
+
+def build_agent(script, dependencies: list, modules: list=(), directory: str=AGENT_DIRECTORY) -> str:
+    """
+
+    Build the agent archive, reusing a cached archive with the same hash.
+
+    Parameters
+    ----------
+    script : importlib.abc.Traversable or str
+        Camera control script run as the archive entry point.
+    dependencies : list
+        Wheels and source distributions of the pure-Python dependencies.
+    modules : list
+        Modules imported by the script, added at the top level of the archive.
+    directory : str
+        Directory in which archives are cached. Defaults to ~/.geocam/agents.
+
+    Returns
+    -------
+    str
+        Path of the agent archive.
+
+    """
+    filename = os.path.join(directory, agent_name(script, dependencies, modules))
+    with _lock:
+        if os.path.exists(filename):
+            return filename
+        os.makedirs(directory, exist_ok=True)
+        temporary = filename + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(SHEBANG)
+            with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                for dependency in sorted(dependencies, key=_basename):
+                    for name, data in _members(dependency):
+                        _add(archive, name, data)
+                for module in sorted(modules, key=_basename):
+                    _add(archive, _basename(module), _read(module))
+                _add(archive, "__main__.py", _read(script))
+        os.chmod(temporary, 0o755)
+        os.replace(temporary, filename)
+        log.info("Built camera agent {filename}".format(filename=filename))
+        return filename
+
+
+def _members(dependency):
+    # Yield the importable files of a wheel, or the package sources of a source distribution.
+    name = _basename(dependency)
+    if name.endswith(".whl"):
+        with _open(dependency) as fileobj, zipfile.ZipFile(fileobj) as wheel:
+            for member in sorted(wheel.namelist()):
+                if not member.endswith("/"):
+                    yield member, wheel.read(member)
+    elif name.endswith(".tar.gz"):
+        # Only the pure-Python modules are used; optional C speedups fall back to Python.
+        with _open(dependency) as fileobj, tarfile.open(fileobj=fileobj, mode="r:gz") as sdist:
+            for member in sorted(sdist.getmembers(), key=lambda m: m.name):
+                parts = member.name.split("/")
+                if member.isfile() and len(parts) > 3 and parts[1] == "src" and parts[-1].endswith((".py", ".typed")):
+                    yield "/".join(parts[2:]), sdist.extractfile(member).read()
+    else:
+        raise ValueError("Unsupported dependency {name}".format(name=name))
+
+
+def _add(archive: zipfile.ZipFile, name: str, data: bytes) -> None:
+    info = zipfile.ZipInfo(name, date_time=TIMESTAMP)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    archive.writestr(info, data)
+
+
+def _basename(f) -> str:
+    return f.name if hasattr(f, "name") else os.path.basename(f)
+
+
+def _read(f) -> bytes:
+    if hasattr(f, "read_bytes"):
+        return f.read_bytes()
+    with open(f, "rb") as file:
+        return file.read()
+
+
+def _open(f):
+    return f.open("rb") if hasattr(f, "open") else open(f, "rb")
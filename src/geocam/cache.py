@@ -0,0 +1,135 @@
+"""
+
+Discovery cache module for geocam.
+
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".geocam")
+
+
+class DiscoveryCache:
+    def __init__(self, filename: str=None):
+        """
+
+        Persistent record of every camera seen by the controller, keyed by MAC
+        address so that entries survive changes of DHCP address.
+
+        Parameters
+        ----------
+        filename : str, optional
+            Path of the cache file. Defaults to ~/.geocam/cameras.json.
+
+        """
+        self.filename = filename if filename is not None else os.path.join(CACHE_DIRECTORY, "cameras.json")
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        """
+
+        Load the cache from disk, starting empty if it is missing or unreadable.
+
+        """
+        try:
+            with open(self.filename, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable discovery cache {filename}: {e}".format(filename=self.filename, e=e))
+            entries = {}
+        with self._lock:
+            self.entries = entries
+
+    def save(self) -> None:
+        """
+
+        Write the cache to disk atomically.
+
+        """
+        with self._lock:
+            entries = json.dumps(self.entries, indent=4, sort_keys=True)
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            temporary = self.filename + ".tmp"
+            with open(temporary, "w") as f:
+                f.write(entries)
+            os.replace(temporary, self.filename)
+        except OSError as e:
+            log.warning("Failed to save discovery cache {filename}: {e}".format(filename=self.filename, e=e))
+
+    def get(self, mac: str) -> dict | None:
+        """
+
+        Return a copy of the entry for a MAC address.
+
+        Parameters
+        ----------
+        mac : str
+            MAC address of the camera.
+
+        Returns
+        -------
+        dict or None
+            Cached entry, or None if the camera has not been seen before.
+
+        """
+        if mac is None:
+            return None
+        with self._lock:
+            entry = self.entries.get(mac.lower())
+            return dict(entry) if entry is not None else None
+
+    def update(self, mac: str, **fields) -> None:
+        """
+
+        Update the entry for a MAC address and mark it as seen now.
+
+        Parameters
+        ----------
+        mac : str
+            MAC address of the camera.
+        **fields
+            Fields to record, e.g. hostname, ip, script_hash and packages.
+
+        """
+        if mac is None:
+            return
+        with self._lock:
+            entry = self.entries.setdefault(mac.lower(), {})
+            entry.update(fields)
+            entry["last_seen"] = time.time()
+
+
+def neighbours() -> dict:
+    """
+
+    Read the kernel ARP table.
+
+    Returns
+    -------
+    dict
+        IP address keyed by MAC address for every complete neighbour entry.
+        Empty on platforms without /proc/net/arp.
+
+    """
+    table = {}
+    try:
+        with open("/proc/net/arp", "r") as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return table
+    for line in lines:
+        fields = line.split()
+        # IP address, HW type, flags, HW address, mask, device.
+        if len(fields) >= 4 and fields[2] != "0x0" and fields[3] != "00:00:00:00:00:00":
+            table[fields[3].lower()] = fields[0]
+    return table
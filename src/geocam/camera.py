@@ -7,10 +7,17 @@ import json
 import time
 import threading
 import os
+import sys
+import shutil
+import collections
+import concurrent.futures
+import queue
 from picamera2 import Picamera2
+from picamera2.encoders import MJPEGEncoder
+from picamera2.outputs import Output
 import io
 import getmac
-import requests
+from protocol import Reassembler, series_name  # Bundled alongside this script in the camera agent.
 try:
     from greenlet import getcurrent as get_ident
 except ImportError:
@@ -20,106 +27,918 @@ except ImportError:
         from _thread import get_ident
 
 
-class CameraEvent(object):
-    """An Event-like class that signals all active clients when a new frame is
-    available.
+class FrameBroadcaster(object):
+    """Signals all active clients when a new frame is available. Frames are
+    numbered by a generation counter so publishing costs the same however many
+    clients are connected, and clients that stop waiting are reaped in bulk.
     """
-    def __init__(self):
-        self.events = {}
+    def __init__(self, stale_after=5):
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.clients = {}
+        self.stale_after = stale_after
+        self.last_reap = time.time()
 
-    def wait(self):
-        """Invoked from each client's thread to wait for the next frame."""
-        ident = get_ident()
-        if ident not in self.events:
-            # This is a new client.
-            # Add an entry for it in the self.events dict.
-            # Each entry has two elements, a threading.Event() and a timestamp.
-            self.events[ident] = [threading.Event(), time.time()]
-        return self.events[ident][0].wait()
-
-    def set(self):
+    def publish(self):
         """Invoked by the camera thread when a new frame is available."""
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
         now = time.time()
-        remove = None
-        for ident, event in self.events.items():
-            if not event[0].is_set():
-                # If this client's event is not set, then set it
-                # also updates the last set timestamp to now.
-                event[0].set()
-                event[1] = now
-            else:
-                # If the client's event is already set, it means the client
-                # did not process a previous frame.
-                # If the event stays set for more than 5 seconds, then assume
-                # the client is gone and remove it.
-                if now - event[1] > 5:
-                    remove = ident
-        if remove:
-            del self.events[remove]
+        if now - self.last_reap > self.stale_after:
+            self.reap(now)
+
+    def wait(self, generation=None, timeout=None):
+        """Invoked from each client's thread to wait for the next frame after
+        the given generation, which defaults to the last frame this client saw.
+        Returns the new generation, or None if the timeout expired.
+        """
+        ident = get_ident()
+        if generation is None:
+            # A new client waits for the next frame.
+            client = self.clients.get(ident)
+            generation = client[0] if client is not None else self.generation
+        with self.condition:
+            published = self.condition.wait_for(lambda: self.generation > generation, timeout)
+            current = self.generation
+        # Each entry has two elements, the last generation seen and a timestamp.
+        self.clients[ident] = [current, time.time()]
+        return current if published else None
+
+    def reap(self, now=None):
+        """Remove every client that has not waited for a frame recently."""
+        now = now or time.time()
+        stale = [ident for ident, client in list(self.clients.items()) if now - client[1] > self.stale_after]
+        for ident in stale:
+            self.clients.pop(ident, None)
+        self.last_reap = now
+        return len(stale)
+
+
+class FrameBuffer(io.BufferedIOBase):
+    """A preallocated, reusable buffer that JPEG frames are encoded into and
+    handed around as memoryviews without copying.
+    """
+    def __init__(self, size=1024*1024):
+        super().__init__()
+        self.data = bytearray(size)
+        self.length = 0
+        self._bytes = None
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        b = memoryview(b).cast("B")
+        end = self.length + b.nbytes
+        if end > len(self.data):
+            # Replace rather than resize, as views of the old data may still be in use.
+            data = bytearray(max(end, 2*len(self.data)))
+            data[:self.length] = memoryview(self.data)[:self.length]
+            self.data = data
+        self.data[self.length:end] = b
+        self.length = end
+        return b.nbytes
+
+    def reset(self):
+        """Empty the buffer for reuse, keeping its allocated memory."""
+        self.length = 0
+        self._bytes = None
+
+    @property
+    def view(self):
+        """A memoryview of the frame without copying it."""
+        return memoryview(self.data)[:self.length]
+
+    def tobytes(self):
+        """Return the frame as bytes, copied at most once however many
+        clients need it.
+        """
+        if self._bytes is None:
+            self._bytes = bytes(self.view)
+        return self._bytes
+
+
+class FramePool(object):
+    """A fixed set of frame buffers reused in rotation, so the number of
+    allocations does not grow with the frame rate or number of clients.
+    """
+    def __init__(self, count, size=1024*1024):
+        self.buffers = [FrameBuffer(size) for _ in range(count)]
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Return the least recently used buffer, emptied for reuse."""
+        with self.lock:
+            buffer = self.buffers[self.index]
+            self.index = (self.index + 1) % len(self.buffers)
+        buffer.reset()
+        return buffer
+
+
+class FrameRingBuffer(object):
+    """A ring buffer of recent frames tagged with their sensor timestamps,
+    bounded by both memory and frame count.
+    """
+    def __init__(self, max_bytes=32*1024*1024, max_frames=16):
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.frames = collections.deque()
+        self.sizes = collections.deque()
+        self.size = 0
+        self.condition = threading.Condition()
+
+    def append(self, frame, timestamp):
+        """Invoked by the camera thread to store a new frame."""
+        with self.condition:
+            self.frames.append((frame, timestamp))
+            self.sizes.append(frame.length)
+            self.size += frame.length
+            # Always keep the newest frame, even if it alone exceeds the limit.
+            while len(self.frames) > 1 and (self.size > self.max_bytes or len(self.frames) > self.max_frames):
+                self.frames.popleft()
+                self.size -= self.sizes.popleft()
+            self.condition.notify_all()
+
+    def closest(self, target, timeout=2.0):
+        """Return the frame and timestamp closest to the target time, waiting
+        for a frame at or after the target if it is still in the future.
+        """
+        wait = max(target - time.time(), 0) + timeout
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.frames) > 0 and self.frames[-1][1] >= target, wait)
+            if len(self.frames) == 0:
+                return None, None
+            return min(self.frames, key=lambda entry: abs(entry[1] - target))
 
     def clear(self):
-        """Invoked from each client's thread after a frame was processed."""
-        self.events[get_ident()][0].clear()
+        """Discard all buffered frames."""
+        with self.condition:
+            self.frames.clear()
+            self.sizes.clear()
+            self.size = 0
 
 
 class BaseCamera(object):
     thread = None  # Background thread that reads frames from camera.
     frame = None  # Current frame is stored here by background thread.
+    timestamp = None  # Sensor timestamp of the current frame.
     last_access = 0  # Time of last client access to the camera.
-    event = CameraEvent()
+    idle_timeout = None  # Time without access after which the camera thread pauses.
+    paused = False  # Whether the camera has been paused by the idle timeout.
+    active_time = 0.0  # Accumulated time with the camera thread running.
+    idle_time = 0.0  # Accumulated time with the camera thread paused.
+    state_changed = time.time()  # Time the camera thread last started or paused.
+    lock = threading.Lock()
+    event = FrameBroadcaster()
+    buffer = FrameRingBuffer()  # Recent frames for trigger-accurate captures.
 
     def __init__(self):
         """Start the background camera thread if it isn't running yet."""
-        if BaseCamera.thread is None:
-            BaseCamera.last_access = time.time()
+        BaseCamera.state_changed = time.time()
+        self.wake()
+
+    def wake(self):
+        """Record an access and start the background camera thread if it
+        isn't running, waiting until its first frame is available.
+        """
+        BaseCamera.last_access = time.time()
+        with BaseCamera.lock:
+            if BaseCamera.thread is not None:
+                return
+            if BaseCamera.paused:
+                # Warm resume of a camera that is already configured.
+                self.resume()
+                BaseCamera.paused = False
+                BaseCamera._account(False)
+            generation = BaseCamera.event.generation
 
             # Start background frame thread.
             BaseCamera.thread = threading.Thread(target=self._thread)
             BaseCamera.thread.start()
 
-            # Wait until first frame is available.
-            BaseCamera.event.wait()
+        # Wait until first frame is available.
+        BaseCamera.event.wait(generation)
+
+    def pause(self):
+        """Stop the camera while the background thread is idle."""
+
+    def resume(self):
+        """Restart the camera after the background thread was idle."""
+
+    def metrics(self):
+        """Return the activity metrics of the camera thread."""
+        now = time.time()
+        active = BaseCamera.thread is not None
+        return {
+            "active": active,
+            "active_time": BaseCamera.active_time + (now - BaseCamera.state_changed if active else 0.0),
+            "idle_time": BaseCamera.idle_time + (0.0 if active else now - BaseCamera.state_changed),
+            "idle_timeout": BaseCamera.idle_timeout,
+            "clients": len(BaseCamera.event.clients),
+            "generation": BaseCamera.event.generation,
+        }
+
+    @staticmethod
+    def _account(active):
+        # Add the time since the last state change to the active or idle total.
+        now = time.time()
+        if active:
+            BaseCamera.active_time += now - BaseCamera.state_changed
+        else:
+            BaseCamera.idle_time += now - BaseCamera.state_changed
+        BaseCamera.state_changed = now
+
+    def _idle(self):
+        return BaseCamera.idle_timeout is not None and time.time() - BaseCamera.last_access > BaseCamera.idle_timeout
 
     def get_frame(self):
         """Return the current camera frame."""
-        BaseCamera.last_access = time.time()
+        self.wake()
 
         # Wait for a signal from the camera thread.
         BaseCamera.event.wait()
-        BaseCamera.event.clear()
 
         return BaseCamera.frame
 
+    def capture_still(self, target=None):
+        """Return the frame to save for a capture command and its timestamp,
+        selecting the buffered frame closest to the target time if given.
+        """
+        if target is not None:
+            frame, timestamp = BaseCamera.buffer.closest(target)
+            if frame is not None:
+                log.debug("Captured frame {offset:.4f} s from target time.".format(offset=timestamp - target))
+                return frame, timestamp
+        return BaseCamera.frame, BaseCamera.timestamp
+
+    def capture_burst(self, count, rate=None, start=None, max_bytes=None):
+        """Capture count distinct frames into memory, no faster than rate frames
+        per second from the start time in seconds since the epoch, and return
+        them as a list of (data, timestamp) pairs. Each frame is copied out of
+        its buffer as soon as it is captured. The burst stops early rather than
+        hold more than max_bytes of frames.
+        """
+        self.wake()
+        if start is not None and start > time.time():
+            time.sleep(start - time.time())
+        interval = 1.0/rate if rate else 0.0
+        origin = time.monotonic()
+        frames = []
+        size = 0
+        last = None
+        for n in range(count):
+            remaining = origin + n*interval - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            BaseCamera.last_access = time.time()
+            frame, timestamp = self.capture_still(time.time())
+            while last is not None and timestamp is not None and timestamp <= last:
+                # Faster than the sensor, so wait for the next frame.
+                BaseCamera.event.wait(timeout=1.0)
+                frame, timestamp = self.capture_still(time.time())
+            data = frame.tobytes()
+            if max_bytes is not None and len(frames) > 0 and size + len(data) > max_bytes:
+                log.warning("Burst stopped after {n} of {count} frames to stay within {max_bytes} bytes.".format(n=n, count=count, max_bytes=max_bytes))
+                break
+            frames.append((data, timestamp))
+            size += len(data)
+            last = timestamp
+        return frames
+
     def frames(self):
-        """"Generator that returns frames from the camera."""
+        """"Generator that returns frames and their timestamps from the camera."""
         raise RuntimeError('Must be implemented by subclasses.')
 
     def _thread(self):
         """Camera background thread."""
         print('Starting camera thread.')
         frames_iterator = self.frames()
-        for frame in frames_iterator:
+        for frame, timestamp in frames_iterator:
             BaseCamera.frame = frame
-            BaseCamera.event.set()  # Send signal to clients.
+            BaseCamera.timestamp = timestamp
+            BaseCamera.buffer.append(frame, timestamp)
+            BaseCamera.event.publish()  # Send signal to clients.
             time.sleep(0)
 
+            # Pause if nobody has requested a frame within the idle timeout.
+            if self._idle():
+                with BaseCamera.lock:
+                    if self._idle():
+                        frames_iterator.close()
+                        self.pause()
+                        BaseCamera.buffer.clear()
+                        BaseCamera.paused = True
+                        BaseCamera.thread = None
+                        BaseCamera._account(True)
+                        print('Camera thread paused while idle.')
+                        break
+
+class PreviewOutput(Output):
+    """Encoder output that hands each preview frame to the camera thread."""
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.frame = None
+        self.timestamp = None
+        self.condition = threading.Condition()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        buffer = self.pool.acquire()
+        buffer.write(frame)
+        with self.condition:
+            self.frame = buffer
+            self.timestamp = time.time()
+            self.condition.notify_all()
+
+    def read(self):
+        """Wait for the next encoded frame and return it with its timestamp."""
+        with self.condition:
+            self.condition.wait()
+            return self.frame, self.timestamp
+
+
+class CommandDispatcher(object):
+    """Receives commands over UDP and dispatches them without blocking the
+    socket. Capture commands run on a dedicated high-priority thread and slow
+    commands on a pool of worker threads.
+    """
+    def __init__(self, workers=2, queue_size=64, history=256):
+        self.handlers = {}
+        self.priority_queue = queue.Queue(maxsize=queue_size)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.counters = {"received": 0, "dispatched": 0, "dropped": 0, "failed": 0, "duplicates": 0}
+        self.lock = threading.Lock()
+        self.hostname = socket.gethostname().split(".")[0]
+        self.history = history
+        self.seen = collections.OrderedDict()  # Ids of recently received commands.
+        self.in_flight = 0  # Batches accepted but not yet finished.
+        self.socket = None
+        self.reassembler = Reassembler()
+
+    def register(self, command, handler, priority=False, immediate=False):
+        """Register a handler called with the command arguments, the sender
+        address and the wall clock time the command was received. Batches
+        containing a priority command run on the high-priority thread. Batches
+        of only immediate commands run on the receiving thread itself, so they
+        never wait behind queued commands, and must return quickly.
+        """
+        self.handlers[command] = (handler, priority, immediate)
+
+    def listen(self, group, port):
+        """Join the multicast group and dispatch commands as they arrive."""
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        udp_socket.bind(('', port))
+        mreq = struct.pack("4sl", socket.inet_aton(group), socket.INADDR_ANY)
+        udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        self.socket = udp_socket
+        threading.Thread(target=self._priority_loop, daemon=True).start()
+
+        # Listen for incoming commands on UDP.
+        while True:
+            data, ip_addr = udp_socket.recvfrom(65535)
+            self.dispatch(data, ip_addr, time.time())
+
+    def dispatch(self, data, ip_addr, received):
+        """Hand the commands in a received envelope to their handlers."""
+        self._count("received")
+        try:
+            envelope = self.reassembler.add(data, ip_addr)
+            if envelope is None:
+                # Waiting for the remaining fragments.
+                return
+            jobs = []
+            priority = False
+            immediate = len(envelope["commands"]) > 0
+            for command in envelope["commands"]:
+                handler, urgent, inline = self.handlers[command["command"]]
+                jobs.append((handler, command.get("args", {})))
+                immediate = immediate and inline
+                priority = priority or urgent
+        except Exception:
+            log.error("Dropped unrecognised command from {ip_addr}.".format(ip_addr=ip_addr))
+            self._count("dropped")
+            return
+        id = envelope.get("id")
+        duplicate = id is not None and id in self.seen
+        if not duplicate:
+            # Count the batch as in flight before acknowledging it, so the sender never sees an
+            # acknowledged command that is not reported by the status.
+            self._track(1)
+        if id is not None:
+            # Acknowledge receipt, including retransmissions whose first acknowledgement was lost.
+            self.acknowledge([id], ip_addr)
+            if duplicate:
+                self._count("duplicates")
+                return
+            self.seen[id] = envelope.get("seq")
+            if len(self.seen) > self.history:
+                self.seen.popitem(last=False)
+        log.debug("Commands {commands} received from {ip_addr} on UDP.".format(commands=envelope["commands"], ip_addr=ip_addr))
+        try:
+            # Commands in a batch run in order on a single path.
+            if immediate:
+                self._run(jobs, ip_addr, received)
+            elif priority:
+                self.priority_queue.put_nowait((jobs, ip_addr, received))
+            else:
+                self.executor.submit(self._run, jobs, ip_addr, received)
+            self._count("dispatched")
+        except queue.Full:
+            log.error("Dropped commands from {ip_addr} as the queue is full.".format(ip_addr=ip_addr))
+            self._count("dropped")
+            self._track(-1)
+
+    def acknowledge(self, ids, ip_addr):
+        """Send a lightweight acknowledgement of the command ids to the sender."""
+        message = {"ack": ids, "hostname": self.hostname}
+        try:
+            self.socket.sendto(json.dumps(message).encode(), ip_addr)
+        except Exception:
+            log.error("Failed to acknowledge command from {ip_addr}.".format(ip_addr=ip_addr))
+
+    def reply(self, message, ip_addr):
+        """Send a response message directly to the sender over UDP."""
+        try:
+            self.socket.sendto(json.dumps(message).encode(), ip_addr)
+        except Exception:
+            log.error("Failed to reply to {ip_addr}.".format(ip_addr=ip_addr))
+
+    def metrics(self):
+        """Return the command counters."""
+        with self.lock:
+            metrics = dict(self.counters)
+            metrics["in_flight"] = self.in_flight
+        metrics["queued"] = self.priority_queue.qsize()
+        return metrics
+
+    def _priority_loop(self):
+        while True:
+            self._run(*self.priority_queue.get())
+
+    def _run(self, jobs, ip_addr, received):
+        for handler, args in jobs:
+            try:
+                handler(args, ip_addr, received)
+            except Exception:
+                log.exception("Command from {ip_addr} failed.".format(ip_addr=ip_addr))
+                self._count("failed")
+        self._track(-1)
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _track(self, change):
+        with self.lock:
+            self.in_flight += change
+
+
+class ImageSpool(object):
+    """Holds captured images in memory and writes them to persistent storage on
+    a background thread, so slow SD card writes never delay the next command.
+    The spool is bounded in bytes: when it is full, submit either waits for
+    room (policy "block") or rejects the image (policy "drop"). Images are also
+    rejected if writing them would leave less than min_free bytes on disk.
+    """
+    def __init__(self, max_bytes=64*1024*1024, min_free=256*1024*1024, policy="block", timeout=5.0):
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.policy = policy
+        self.timeout = timeout
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        self.condition = threading.Condition()
+        self.counters = {"written": 0, "bytes": 0, "dropped": 0, "disk_full": 0, "failed": 0}
+        self.latency = {"mean": 0.0, "max": 0.0}  # Time from capture to image on disk.
+        self.write_time = {"mean": 0.0, "max": 0.0}  # Time spent writing each image.
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, path, data, on_written=None):
+        """Queue image data to be written to path, calling on_written(path) once
+        it is on disk. Returns False if the image was rejected.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        with self.condition:
+            free = shutil.disk_usage(directory).free - self.queued_bytes
+            if free - len(data) < self.min_free:
+                self.counters["disk_full"] += 1
+                log.error("Not enough free space to save {path} ({free} bytes free).".format(path=path, free=free))
+                return False
+            if self.queued_bytes + len(data) > self.max_bytes and len(self.queue) > 0:
+                if self.policy == "block":
+                    # Back-pressure: wait for the writer to make room.
+                    self.condition.wait_for(lambda: self.queued_bytes + len(data) <= self.max_bytes or len(self.queue) == 0, self.timeout)
+                if self.queued_bytes + len(data) > self.max_bytes and len(self.queue) > 0:
+                    self.counters["dropped"] += 1
+                    log.error("Image spool full, dropped {path}.".format(path=path))
+                    return False
+            self.queue.append((path, data, on_written, time.monotonic()))
+            self.queued_bytes += len(data)
+            self.condition.notify_all()
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until every queued image has been written."""
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.queue) == 0, timeout)
+
+    def metrics(self):
+        """Return the spool depth, counters and write latencies."""
+        with self.condition:
+            metrics = dict(self.counters)
+            metrics["queued"] = len(self.queue)
+            metrics["queued_bytes"] = self.queued_bytes
+            metrics["latency"] = dict(self.latency)
+            metrics["write_time"] = dict(self.write_time)
+        try:
+            metrics["free"] = shutil.disk_usage(os.getcwd()).free
+        except OSError:
+            metrics["free"] = None
+        return metrics
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0:
+                    self.condition.wait()
+                path, data, on_written, queued = self.queue[0]
+            start = time.monotonic()
+            try:
+                # Write to a temporary file and rename so readers never see a partial image.
+                partial = path + ".part"
+                with open(partial, "wb") as f:
+                    f.write(data)
+                os.replace(partial, path)
+                written = True
+            except OSError as e:
+                log.error("Failed to write {path}: {e}".format(path=path, e=e))
+                written = False
+            end = time.monotonic()
+            with self.condition:
+                self.queue.popleft()
+                self.queued_bytes -= len(data)
+                if written:
+                    self.counters["written"] += 1
+                    self.counters["bytes"] += len(data)
+                    n = self.counters["written"]
+                    for stats, value in ((self.latency, end - queued), (self.write_time, end - start)):
+                        stats["mean"] += (value - stats["mean"])/n
+                        stats["max"] = max(stats["max"], value)
+                else:
+                    self.counters["failed"] += 1
+                self.condition.notify_all()
+            if written and on_written is not None:
+                on_written(path)
+
+
+class ImageStreamer(object):
+    """Pushes captured images to the receiver on the controller over TCP. Each
+    image stays on disk until the receiver acknowledges it and is resent after
+    a reconnect. Only one image is in flight at a time, and the queue is bounded
+    so that a slow or absent receiver never holds up captures: images that do
+    not fit, or that the receiver rejects max_rejections times, are left on
+    disk for recovery over SSH.
+    """
+    FRAME = struct.Struct("!II")
+
+    def __init__(self, port, max_queued=64, delete_acknowledged=False, max_rejections=3):
+        self.port = port
+        self.max_queued = max_queued
+        self.max_rejections = max_rejections
+        self.delete_acknowledged = delete_acknowledged
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.counters = {"sent": 0, "bytes": 0, "deferred": 0, "retries": 0, "missing": 0, "rejected": 0}
+        self.connected = False
+        self.thread = None
+
+    def submit(self, path, host, metadata):
+        """Queue an image for streaming to the host. Returns False if the queue is full."""
+        with self.condition:
+            if len(self.queue) >= self.max_queued:
+                self.counters["deferred"] += 1
+                log.error("Stream queue full, leaving {path} for recovery.".format(path=path))
+                return False
+            self.queue.append((host, path, metadata))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return True
+
+    def metrics(self):
+        """Return the streaming counters."""
+        with self.condition:
+            metrics = dict(self.counters)
+            metrics["queued"] = len(self.queue)
+        metrics["connected"] = self.connected
+        return metrics
+
+    def _run(self):
+        connection = None
+        backoff = 0.5
+        rejections = 0
+        while True:
+            with self.condition:
+                while len(self.queue) == 0:
+                    self.condition.wait()
+                host, path, metadata = self.queue[0]
+            try:
+                if connection is None or connection.getpeername()[0] != host:
+                    if connection is not None:
+                        connection.close()
+                    connection = socket.create_connection((host, self.port), timeout=10)
+                    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self.connected = True
+                size = self._send(connection, path, metadata)
+            except FileNotFoundError:
+                log.error("Image {path} no longer exists, not streaming it.".format(path=path))
+                rejections = 0
+                self._complete("missing")
+                continue
+            except (OSError, ValueError) as e:
+                # Keep the image at the head of the queue and retry after reconnecting.
+                log.error("Streaming {path} failed: {e}".format(path=path, e=e))
+                if connection is not None:
+                    connection.close()
+                connection = None
+                self.connected = False
+                with self.condition:
+                    self.counters["retries"] += 1
+                time.sleep(backoff)
+                backoff = min(2*backoff, 10.0)
+                continue
+            backoff = 0.5
+            if size is None:
+                # The receiver could not store the image, so give up on it after a few attempts rather than
+                # hold up the rest of the queue.
+                rejections += 1
+                with self.condition:
+                    self.counters["retries"] += 1
+                if rejections >= self.max_rejections:
+                    log.error("Receiver rejected {path} {n} times, leaving it for recovery.".format(path=path, n=rejections))
+                    rejections = 0
+                    self._complete("rejected")
+                else:
+                    time.sleep(0.5)
+                continue
+            rejections = 0
+            self._complete("sent", size)
+            if self.delete_acknowledged:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _complete(self, counter, size=0):
+        with self.condition:
+            self.queue.popleft()
+            self.counters[counter] += 1
+            self.counters["bytes"] += size
+
+    def _send(self, connection, path, metadata):
+        # Send the image and wait for the receiver to acknowledge it, returning None if it was rejected.
+        with open(path, "rb") as f:
+            data = f.read()
+        filename = os.path.basename(path)
+        header = json.dumps(dict(metadata, filename=filename)).encode()
+        connection.sendall(self.FRAME.pack(len(header), len(data)) + header)
+        connection.sendall(data)
+        prefix = self._receive(connection, self.FRAME.size)
+        header_length, _ = self.FRAME.unpack(prefix)
+        reply = json.loads(self._receive(connection, header_length))
+        if reply.get("nack") == filename:
+            return None
+        if reply.get("ack") != filename:
+            raise ValueError("Receiver did not acknowledge {filename}.".format(filename=filename))
+        return len(data)
+
+    def _receive(self, connection, n):
+        data = b""
+        while len(data) < n:
+            chunk = connection.recv(n - len(data))
+            if not chunk:
+                raise ValueError("Receiver closed the connection.")
+            data += chunk
+        return data
+
+
+class TimelapseSchedule(object):
+    """Runs a time-lapse locally so that it keeps going if the controller or
+    network goes away. Frame n is due at start + n*interval on the camera's
+    monotonic clock; deadlines missed while paused or offline are skipped
+    rather than fired late. The schedule and its progress are saved to a file
+    so that it resumes after the agent or the camera restarts.
+    """
+    def __init__(self, filename, capture):
+        self.filename = filename
+        self.capture = capture
+        self.condition = threading.Condition()
+        self.state = None
+        self.origin = None  # Start time of the schedule on the monotonic clock.
+        self.load()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def load(self):
+        """Load a saved schedule, if any."""
+        try:
+            with open(self.filename, "r") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = None
+        except Exception:
+            log.error("Could not read {file}, ignoring saved schedule.".format(file=self.filename))
+            self.state = None
+        if self.state is not None:
+            # The monotonic clock restarts from zero after a reboot, so map the saved wall clock start onto it.
+            self.origin = self._monotonic(self.state["start"])
+
+    def start(self, filename, interval, count, start=None, fmt="jpg", stream_to=None):
+        """Replace any existing schedule with a new one starting at the given
+        time in seconds since the epoch, or now.
+        """
+        with self.condition:
+            self.state = {
+                "filename": filename,
+                "format": fmt,
+                "start": start if start is not None else time.time(),
+                "interval": interval,
+                "count": count,
+                "status": "running",
+                "next": 0,  # Index of the next frame due.
+                "captured": 0,
+                "missed": 0,
+                "last": None,
+                "stream_to": stream_to,
+            }
+            self.origin = self._monotonic(self.state["start"])
+            self._save()
+            self.condition.notify_all()
+
+    def pause(self):
+        self._set_status("running", "paused")
+
+    def resume(self):
+        self._set_status("paused", "running")
+
+    def cancel(self):
+        self._set_status(None, "cancelled")
+
+    def status(self):
+        """Return a copy of the schedule and its progress."""
+        with self.condition:
+            return dict(self.state) if self.state is not None else {}
+
+    def _set_status(self, current, status):
+        with self.condition:
+            if self.state is None or self.state["status"] in ("complete", "cancelled"):
+                return
+            if current is None or self.state["status"] == current:
+                self.state["status"] = status
+                self._save()
+                self.condition.notify_all()
+
+    @staticmethod
+    def _monotonic(t):
+        # Convert a wall clock time to the monotonic clock, which later wall clock steps do not affect.
+        return time.monotonic() + t - time.time()
+
+    def _save(self):
+        # Write atomically so a power cut never leaves a corrupt schedule.
+        temporary = self.filename + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.state, f, indent=4)
+        os.replace(temporary, self.filename)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                state = self.state
+                if state is None or state["status"] != "running":
+                    self.condition.wait()
+                    continue
+                origin = self.origin
+                n = state["next"]
+                if n >= state["count"]:
+                    state["status"] = "complete"
+                    self._save()
+                    continue
+                delay = origin + n*state["interval"] - time.monotonic()
+                if delay > 0:
+                    # Wake early on any command so pause, resume and cancel take effect immediately.
+                    self.condition.wait(delay)
+                    continue
+                if -delay > max(0.5*state["interval"], 0.05):
+                    # Skip deadlines missed while paused or offline and keep the original time base.
+                    due = min(int(-delay/state["interval"]) + 1 if state["interval"] > 0 else 1, state["count"] - n)
+                    state["missed"] += due
+                    state["next"] = n + due
+                    self._save()
+                    continue
+                state["next"] = n + 1
+                filename = series_name(state["filename"], n + 1)
+                fmt = state["format"]
+                stream_to = state["stream_to"]
+            try:
+                self.capture(filename, fmt, stream_to)
+                captured = True
+            except Exception as e:
+                log.error("Scheduled capture {filename} failed: {e}".format(filename=filename, e=e))
+                captured = False
+            with self.condition:
+                if self.state is state:
+                    if captured:
+                        state["captured"] += 1
+                        state["last"] = filename
+                    else:
+                        state["missed"] += 1
+                    self._save()
+
+
 class Camera(BaseCamera):
 
-    def __init__(self):
+    def __init__(self, configuration):
+        self.mode = configuration["mode"]
+        self.preview_fps = configuration["preview_fps"]
+        BaseCamera.idle_timeout = configuration["idle_timeout"]
+        BaseCamera.buffer.max_frames = configuration["buffer_frames"]
+
+        # Frames are encoded into pooled buffers. The pool holds every frame in the
+        # ring buffer plus spares for the frame being encoded and those being sent.
+        self.pool = FramePool(configuration["buffer_frames"] + 3)
+        self.still_pool = FramePool(2)
         self.camera = Picamera2()
-        self.config = self.camera.create_still_configuration()
+        if self.mode == "dual":
+            # Full resolution main stream for stills and a small lores stream for the preview.
+            self.config = self.camera.create_video_configuration(
+                main={"size": self.camera.sensor_resolution},
+                lores={"size": tuple(configuration["preview_size"])},
+                encode="lores",
+                controls={"FrameRate": self.preview_fps},
+            )
+        else:
+            self.config = self.camera.create_still_configuration()
         self.camera.configure(self.config)
         self.camera.start()
         time.sleep(2)
         super().__init__()
 
-    def frames(self):   
-        frame = io.BytesIO()
+    def pause(self):
+        self.camera.stop()
+
+    def resume(self):
+        self.camera.start()
+
+    def frames(self):
+        if self.mode == "dual":
+            return self._preview_frames()
+        return self._still_frames()
+
+    def capture_still(self, target=None):
+        if self.mode != "dual":
+            return super().capture_still(target)
+
+        # Encode a full resolution still from the first frame at or after the target time.
+        frame = self.still_pool.acquire()
+        tolerance = 0.5/self.preview_fps
         while True:
-            frame.seek(0)
-            self.camera.capture_file(frame, format='jpeg')
-            frame.seek(0)
-            yield frame.getvalue()
+            request = self.camera.capture_request()
+            try:
+                timestamp = self._sensor_time(request.get_metadata()["SensorTimestamp"])
+                if target is None or timestamp >= target - tolerance:
+                    request.save("main", frame, format='jpeg')
+                    break
+            finally:
+                request.release()
+        return frame, timestamp
+
+    def _preview_frames(self):
+        # Encode the lores stream in hardware so full resolution frames are only encoded on demand.
+        output = PreviewOutput(self.pool)
+        self.camera.start_encoder(MJPEGEncoder(), output, name="lores")
+        try:
+            while True:
+                yield output.read()
+        finally:
+            self.camera.stop_encoder()
+
+    def _still_frames(self):
+        while True:
+            frame = self.pool.acquire()
+            request = self.camera.capture_request()
+            try:
+                request.save("main", frame, format='jpeg')
+                timestamp = self._sensor_time(request.get_metadata()["SensorTimestamp"])
+            finally:
+                request.release()
+            yield frame, timestamp
+
+    def _sensor_time(self, sensor_timestamp):
+        """Convert a sensor timestamp in nanoseconds since boot to wall-clock time."""
+        return time.time() - time.clock_gettime(time.CLOCK_BOOTTIME) + sensor_timestamp/1e9
 
     def update_controls(self, controls):
         self.camera.set_controls(controls)
@@ -200,14 +1019,54 @@ MCAST_GRP = '225.1.1.1'
 MCAST_PORT = 3179
 TCP_PORT = 1645
 
+# Versioned agent archive this script runs from, through the geocam-agent.pyz link, so the controller can spot outdated agents.
+AGENT = os.path.basename(os.path.realpath(sys.argv[0]))
+
+# Startup configuration, overridden by camera.json in the home directory.
+CONFIGURATION_FILE = os.path.join(os.path.expanduser("~"), "camera.json")
+SCHEDULE_FILE = os.path.join(os.path.expanduser("~"), "geocam-schedule.json")
+DEFAULT_CONFIGURATION = {
+    "mode": "still",  # "still" for full resolution preview frames or "dual" for a lores preview stream.
+    "preview_size": [640, 480],
+    "preview_fps": 10,
+    "idle_timeout": 60,  # Seconds without preview or capture requests before the camera pauses, or null to never pause.
+    "buffer_frames": 8,  # Number of recent frames kept for trigger-accurate captures.
+    "spool_bytes": 64*1024*1024,  # Memory used to hold images waiting to be written to storage.
+    "spool_policy": "block",  # "block" to wait for room in a full spool or "drop" to reject the image.
+    "min_free_bytes": 256*1024*1024,  # Images are rejected rather than fill the storage beyond this.
+    "stream_queue": 64,  # Maximum number of images waiting to be streamed to the controller.
+    "stream_delete": False,  # Delete images once the controller has acknowledged them.
+}
+
+def load_configuration():
+    configuration = dict(DEFAULT_CONFIGURATION)
+    try:
+        with open(CONFIGURATION_FILE, "r") as f:
+            configuration.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception:
+        log.error("Could not read {file}, using default configuration.".format(file=CONFIGURATION_FILE))
+    return configuration
+
 # Create camera instance.
-camera = Camera()
+configuration = load_configuration()
+camera = Camera(configuration)
+
+# Multipart MJPEG framing.
+BOUNDARY = b'--frame\r\n'
+HEADER = b'Content-Type: image/jpeg\r\n\r\n'
+TRAILER = b'\r\n--frame\r\n'
 
 def gen():
-    yield b'--frame\r\n'
+    yield BOUNDARY
     while True:
+        # Header, payload and trailer are sent separately rather than concatenated. The
+        # payload is shared by all clients as the server requires bytes, not memoryviews.
         frame = camera.get_frame()
-        yield b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n--frame\r\n'
+        yield HEADER
+        yield frame.tobytes()
+        yield TRAILER
 
 @app.route('/preview')
 def preview():
@@ -218,6 +1077,8 @@ def update_controls():
     if request.method == 'POST':
         data = request.json
         try:
+            # The camera must be running to apply controls and report its metadata.
+            camera.wake()
             for key, value in data.items():
                 control = {key: value}
                 camera.update_controls(control)
@@ -226,40 +1087,129 @@ def update_controls():
             log.error("Unsuccessfully attempted to update camera settings.")
             return jsonify({"success": False})
 
-def capture_frame(args):
+@app.route('/status', methods=['GET'])
+def status():
+    return jsonify({"camera": camera.metrics(), "commands": dispatcher.metrics(), "spool": spool.metrics(), "stream": streamer.metrics(), "clock": clock})
+
+def set_controls(args, ip_addr, received):
+    # Wake a paused camera so the priority thread is never left waiting on a stopped camera.
+    camera.wake()
+    camera.update_controls(args)
+
+def send_hostname_ip_mac(args, ip_addr, received):
+    RPI_ADDR_AND_MAC = {"hostname":camera._get_hostname(), "ip":camera._get_ip_address(), "mac":camera._get_mac_address(), "agent":AGENT}
+    message = {"response": RPI_ADDR_AND_MAC}
+    dispatcher.reply(message, ip_addr)
+
+def capture_frame(args, ip_addr=None, received=None):
     filename = args["filename"]
     fmt = args["format"]
-    image = "{filename}.{fmt}".format(filename=filename, fmt=fmt)
-    with open(image, "wb") as image_file:
-        # Write bytes image to file.
-        image_file.write(camera.frame)
-
-def listen_on_UDP():
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    udp_socket.bind(('', MCAST_PORT)) 
-    mreq = struct.pack("4sl", socket.inet_aton(MCAST_GRP), socket.INADDR_ANY)
-    udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-
-    # Listen for incoming commands on UDP.
-    while True:
-        try: 
-            log.debug("Standing by for commands.")
-            data, ip_addr = udp_socket.recvfrom(1024)
-            command = json.loads(data)
-            log.debug("Command {command} received from {ip_addr} on UDP.".format(command=command, ip_addr=ip_addr))
-            if command["command"] == "get_hostname_ip_mac":
-                RPI_ADDR_AND_MAC = {"hostname":camera._get_hostname(), "ip":camera._get_ip_address(), "mac":camera._get_mac_address()}
-                message = {"response": RPI_ADDR_AND_MAC}
-                url = "http://{ip_addr}:8001/cameraResponse".format(ip_addr=ip_addr[0])
-                requests.post(url, json=message)
-            if command["command"] == "captureFrame":
-                capture_frame(command["args"])
-        except Exception: 
-            pass
+    image = os.path.abspath("{filename}.{fmt}".format(filename=filename, fmt=fmt))
+    camera.wake()
+    frame, timestamp = camera.capture_still(local_time(args.get("time")))
+    on_written = None
+    if args.get("stream") and ip_addr is not None:
+        # Push the image to the controller that sent the command once it is on disk.
+        on_written = lambda path: streamer.submit(path, ip_addr[0], {"hostname": dispatcher.hostname, "time": timestamp})
+    # Copy the image out of the pooled frame buffer and leave the write to the spool.
+    spool.submit(image, frame.tobytes(), on_written)
+
+def capture_burst(args, ip_addr=None, received=None):
+    name = args["filename"]
+    fmt = args.get("format", "jpg")
+    count = args["count"]
+    rate = args.get("rate")
+    stream = args.get("stream") and ip_addr is not None
+    # Frames are held in memory until the burst ends, so bound them by the spool size.
+    frames = camera.capture_burst(count, rate, local_time(args.get("start")), configuration["spool_bytes"])
+
+    # Name frames by their position in the burst and leave the writes to the spool.
+    report = {"filename": name, "requested": count, "count": len(frames), "truncated": len(frames) < count, "rate": rate, "start": local_time(args.get("start")), "clock_offset": clock["offset"], "frames": []}
+    for n, (data, timestamp) in enumerate(frames, 1):
+        image = os.path.abspath("{name}.{fmt}".format(name=series_name(name, n), fmt=fmt))
+        on_written = None
+        if stream:
+            on_written = lambda path, timestamp=timestamp: streamer.submit(path, ip_addr[0], {"hostname": dispatcher.hostname, "time": timestamp})
+        spool.submit(image, data, on_written)
+        report["frames"].append({"filename": os.path.basename(image), "timestamp": timestamp})
+    timestamps = [frame["timestamp"] for frame in report["frames"] if frame["timestamp"] is not None]
+    duration = timestamps[-1] - timestamps[0] if len(timestamps) > 1 else 0.0
+    report["achieved_fps"] = (len(timestamps) - 1)/duration if duration > 0 else None
+
+    # Record the timestamps alongside the images and report the achieved rate to the controller.
+    spool.submit(os.path.abspath("{name}.json".format(name=name)), json.dumps(report, indent=4).encode())
+    if ip_addr is not None:
+        summary = {key: value for key, value in report.items() if key != "frames"}
+        summary["hostname"] = dispatcher.hostname
+        summary["first"] = timestamps[0] if len(timestamps) > 0 else None
+        summary["last"] = timestamps[-1] if len(timestamps) > 0 else None
+        dispatcher.reply({"burst": summary}, ip_addr)
+
+def local_time(t):
+    """Convert a time on the controller's clock to this camera's clock."""
+    return t + clock["offset"] if t is not None else None
+
+def sync_clock(args, ip_addr, received):
+    # Reply with the wall clock times the request was received and the reply sent for an NTP-style estimate.
+    message = {"clock": {"id": args["id"], "hostname": dispatcher.hostname, "t2": received, "t3": time.time()}}
+    dispatcher.reply(message, ip_addr)
+
+def set_clock_offset(args, ip_addr, received):
+    offset = args["offsets"].get(dispatcher.hostname)
+    if offset is not None:
+        clock["offset"] = offset
+        clock["updated"] = time.time()
+
+def scheduled_capture(filename, fmt, stream_to):
+    address = (stream_to, 0) if stream_to is not None else None
+    capture_frame({"filename": filename, "format": fmt, "stream": stream_to is not None}, address)
+
+def start_schedule(args, ip_addr, received):
+    stream_to = ip_addr[0] if args.get("stream") else None
+    schedule.start(args["filename"], args["interval"], args["count"], local_time(args.get("start")), args.get("format", "jpg"), stream_to)
+
+def pause_schedule(args, ip_addr, received):
+    schedule.pause()
+
+def resume_schedule(args, ip_addr, received):
+    schedule.resume()
+
+def cancel_schedule(args, ip_addr, received):
+    schedule.cancel()
+
+def get_schedule(args, ip_addr, received):
+    status = schedule.status()
+    status["hostname"] = dispatcher.hostname
+    dispatcher.reply({"schedule": status}, ip_addr)
+
+# Offset of this camera's clock from the controller's, measured and set by the controller.
+clock = {"offset": 0.0, "updated": None}
+
+# Write images to storage in the background.
+spool = ImageSpool(max_bytes=configuration["spool_bytes"], min_free=configuration["min_free_bytes"], policy=configuration["spool_policy"])
+
+# Stream images to the controller when requested.
+streamer = ImageStreamer(TCP_PORT, max_queued=configuration["stream_queue"], delete_acknowledged=configuration["stream_delete"])
+
+# Dispatch commands received on UDP.
+dispatcher = CommandDispatcher()
+dispatcher.register("captureFrame", capture_frame, priority=True)
+dispatcher.register("captureBurst", capture_burst, priority=True)
+dispatcher.register("updateControls", set_controls)
+dispatcher.register("get_hostname_ip_mac", send_hostname_ip_mac)
+dispatcher.register("startSchedule", start_schedule)
+dispatcher.register("pauseSchedule", pause_schedule)
+dispatcher.register("resumeSchedule", resume_schedule)
+dispatcher.register("cancelSchedule", cancel_schedule)
+dispatcher.register("getSchedule", get_schedule)
+dispatcher.register("syncClock", sync_clock, immediate=True)
+dispatcher.register("setClockOffset", set_clock_offset)
+
+# Resume any time-lapse saved before a restart.
+schedule = TimelapseSchedule(SCHEDULE_FILE, scheduled_capture)
 
 if __name__ == "__main__":
-    UDP_thread = threading.Thread(target=listen_on_UDP)
+    UDP_thread = threading.Thread(target=dispatcher.listen, args=(MCAST_GRP, MCAST_PORT))
     UDP_thread.start()
     app.run(host, port, debug, options)
     
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+
+Connection pool module for geocam.
+
+"""
+from contextlib import contextmanager
+from fabric import Connection
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    def __init__(self, keepalive: int=15, idle_timeout: float=120.0, connect_timeout: float=10.0):
+        """
+
+        Pool of persistent SSH connections, one per camera, shared by all
+        remote operations performed by the Controller.
+
+        Parameters
+        ----------
+        keepalive : int
+            Interval in seconds between SSH keep-alive packets. Defaults to 15.
+        idle_timeout : float
+            Time in seconds after which an unused connection is closed. Defaults to 120.0.
+        connect_timeout : float
+            Timeout in seconds for establishing a new connection. Defaults to 10.0.
+
+        """
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.user = None
+        self.password = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper = None
+
+        # Counters.
+        self.opened = 0
+        self.reused = 0
+        self.reconnected = 0
+        self.evicted = 0
+
+    def set_credentials(self, user: str, password: str) -> None:
+        """
+
+        Set the SSH credentials used for new connections. Pooled connections
+        opened with different credentials are closed.
+
+        Parameters
+        ----------
+        user : str
+            SSH username.
+        password : str
+            SSH password.
+
+        """
+        if user == self.user and password == self.password:
+            return
+        self.close_all()
+        self.user = user
+        self.password = password
+
+    @contextmanager
+    def connection(self, host: str):
+        """
+
+        Context manager that yields an open connection to the host, reusing a
+        pooled connection where possible and reconnecting if it has dropped.
+        The connection is reserved for the calling thread until the block exits.
+
+        Parameters
+        ----------
+        host : str
+            IP address of the host.
+
+        """
+        while True:
+            entry = self._entry(host)
+            entry["lock"].acquire()
+            with self._lock:
+                current = self._entries.get(host) is entry
+            if current:
+                break
+            # Entry was evicted while waiting for the lock.
+            entry["lock"].release()
+        try:
+            c = self._open(host, entry)
+            entry["in_use"] += 1
+            try:
+                yield c
+            except Exception:
+                # Drop the connection if the transport failed so the next caller reconnects.
+                if not c.is_connected:
+                    self._close(entry)
+                raise
+            finally:
+                entry["in_use"] -= 1
+                entry["last_used"] = time.monotonic()
+        finally:
+            entry["lock"].release()
+
+    def discard(self, host: str) -> None:
+        """
+
+        Close and forget the pooled connection to the host, if any.
+
+        Parameters
+        ----------
+        host : str
+            IP address of the host.
+
+        """
+        with self._lock:
+            entry = self._entries.pop(host, None)
+        if entry is not None:
+            with entry["lock"]:
+                self._close(entry)
+
+    def close_all(self) -> None:
+        """
+
+        Close every pooled connection.
+
+        """
+        with self._lock:
+            hosts = list(self._entries)
+        for host in hosts:
+            self.discard(host)
+
+    def stop(self) -> None:
+        """
+
+        Stop the idle eviction thread and close every pooled connection.
+
+        """
+        self._stop.set()
+        self.close_all()
+
+    def stats(self) -> dict:
+        """
+
+        Return the connection counters. Handshakes saved is the number of
+        operations served by an already open connection.
+
+        Returns
+        -------
+        dict
+            Counters for handshakes opened and saved, reconnections and evictions.
+
+        """
+        with self._lock:
+            active = sum(1 for entry in self._entries.values() if entry["connection"] is not None)
+        return {
+            "handshakes_opened": self.opened,
+            "handshakes_saved": self.reused,
+            "reconnected": self.reconnected,
+            "evicted": self.evicted,
+            "active": active,
+        }
+
+    def _entry(self, host: str) -> dict:
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None:
+                entry = {"connection": None, "lock": threading.RLock(), "last_used": time.monotonic(), "in_use": 0}
+                self._entries[host] = entry
+            if self._reaper is None or not self._reaper.is_alive():
+                self._stop.clear()
+                self._reaper = threading.Thread(target=self._evict_idle, daemon=True)
+                self._reaper.start()
+            return entry
+
+    def _open(self, host: str, entry: dict) -> Connection:
+        c = entry["connection"]
+        if c is not None and c.is_connected:
+            self._count("reused")
+            return c
+        if c is not None:
+            # Transport dropped since last use.
+            self._close(entry)
+            self._count("reconnected")
+            log.debug("Reconnecting to {host}".format(host=host))
+        c = Connection(
+            host=host,
+            user=self.user,
+            connect_timeout=self.connect_timeout,
+            connect_kwargs={"password": self.password},
+        )
+        c.open()
+        c.transport.set_keepalive(self.keepalive)
+        entry["connection"] = c
+        self._count("opened")
+        return c
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _close(self, entry: dict) -> None:
+        c = entry["connection"]
+        entry["connection"] = None
+        if c is not None:
+            try:
+                c.close()
+            except Exception:
+                pass
+
+    def _evict_idle(self) -> None:
+        # Close connections that have not been used within the idle timeout.
+        interval = max(1.0, self.idle_timeout/4)
+        while not self._stop.wait(interval):
+            now = time.monotonic()
+            with self._lock:
+                idle = [
+                    (host, entry) for host, entry in self._entries.items()
+                    if entry["in_use"] == 0 and now - entry["last_used"] > self.idle_timeout
+                ]
+                for host, _ in idle:
+                    del self._entries[host]
+            for host, entry in idle:
+                with entry["lock"]:
+                    if entry["connection"] is not None:
+                        self._close(entry)
+                        self._count("evicted")
+                        log.debug("Evicted idle connection to {host}".format(host=host))
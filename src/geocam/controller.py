@@ -1,20 +1,28 @@
 import concurrent.futures
-from fabric import Connection
 import geocam as gc
+from geocam.connections import ConnectionPool
+from geocam.scheduler import CaptureScheduler
+from geocam.probe import SubnetProbe
+from geocam.cache import DiscoveryCache, neighbours
+from geocam.receiver import ImageReceiver
+from geocam import agent, protocol
 import geocam.dependencies as deps
 # import backend.server as server
 import getmac
 from getpass4 import getpass
+import hashlib
 from importlib import resources as impresources
+import io
 import ipaddress
 import json
 import logging
-import networkscan
+import requests
+import shlex
 import socket
+import tarfile
 import threading
 import time
-from queue import Queue
-import sys
+from queue import Empty, Queue
 import os
 from time import sleep
 import copy
@@ -32,6 +40,25 @@ MCAST_GRP = '225.1.1.1'
 MCAST_PORT = 3179
 TCP_PORT = 1645
 
+# Run on each camera to report its state in a single round trip.
+REMOTE_MANIFEST = """
+import json, os, subprocess
+import importlib.metadata as metadata
+home = os.path.expanduser("~")
+agent = os.path.join(home, "geocam-agent.pyz")
+agent = os.path.basename(os.path.realpath(agent)) if os.path.exists(agent) else None
+packages = {d.metadata["Name"]: d.version for d in metadata.distributions() if d.metadata["Name"]}
+try:
+    crontab = subprocess.run(["crontab", "-l"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+except OSError:
+    crontab = ""
+print(json.dumps({"agent": agent, "packages": packages, "crontab": crontab}))
+"""
+
+class ProvisioningError(Exception):
+    """Raised when a camera cannot be provisioned."""
+
+
 class Controller:
 
     def __init__(self, configuration: str=None, password: str=None):
@@ -44,6 +71,12 @@ class Controller:
         self.waiting_for_preview = True
         self.i = 0
         self.log_message = ""
+        self.username = None
+        self.password = None
+
+        # Pooled SSH connections shared by all remote operations.
+        self.pool = ConnectionPool()
+
         if configuration is not None:
             c = open(configuration, 'r')
             self.cameras = json.load(c)
@@ -52,67 +85,79 @@ class Controller:
         if password is not None:
             self.password = password
             
-        # Dependencies.
+        # Camera agent built from the control script, the wire format module it shares with the controller
+        # and its pure-Python dependencies.
         self.camera_control_script = (impresources.files(gc) / 'camera.py')
-        self.launch_script = (impresources.files(gc) / 'launch.py')
-        self.lib2to3_name = 'python3-lib2to3_3.9.2-1_all.deb'
-        self.lib2to3_file = (impresources.files(deps) / 'python3-lib2to3_3.9.2-1_all.deb')
-        self.distutils_name = 'python3-distutils_3.9.2-1_all.deb'
-        self.distutils_file = (impresources.files(deps) / 'python3-distutils_3.9.2-1_all.deb')
-        self.pip_pyz = (impresources.files(deps) / 'pip.pyz')
-        self.getmac_wheel_name = 'getmac-0.9.4-py2.py3-none-any.whl'
-        self.getmac_wheel = (impresources.files(deps) / 'getmac-0.9.4-py2.py3-none-any.whl')
-        self.Flask_wheel_name = 'flask-2.3.3-py3-none-any.whl'
-        self.Flask_wheel = (impresources.files(deps) / 'flask-2.3.3-py3-none-any.whl')
-        self.Flask_Cors_wheel_name = 'Flask_Cors-4.0.0-py2.py3-none-any.whl'
-        self.Flask_Cors_wheel = (impresources.files(deps) / 'Flask_Cors-4.0.0-py2.py3-none-any.whl')
-        self.blinker_wheel_name = 'blinker-1.6.2-py3-none-any.whl'
-        self.blinker_wheel = (impresources.files(deps) / 'blinker-1.6.2-py3-none-any.whl')
-        self.click_wheel_name = 'click-8.1.7-py3-none-any.whl'
-        self.click_wheel = (impresources.files(deps) / 'click-8.1.7-py3-none-any.whl')
-        self.itsdangerous_wheel_name = 'itsdangerous-2.1.2-py3-none-any.whl'
-        self.itsdangerous_wheel = (impresources.files(deps) / 'itsdangerous-2.1.2-py3-none-any.whl')
-        self.Jinja2_wheel_name = 'Jinja2-3.1.2-py3-none-any.whl'
-        self.Jinja2_wheel = (impresources.files(deps) / 'Jinja2-3.1.2-py3-none-any.whl')
-        self.Werkzeug_wheel_name = (impresources.files(deps) / 'werkzeug-2.3.7-py3-none-any.whl')
-        self.Werkzeug_wheel = 'werkzeug-2.3.7-py3-none-any.whl'
-        self.MarkupSafe_wheel_name = 'MarkupSafe-2.1.3.tar.gz'
-        self.MarkupSafe_wheel = (impresources.files(deps) / 'MarkupSafe-2.1.3.tar.gz')
-        
-        # Required packages.
+        self.agent_modules = [impresources.files(gc) / 'protocol.py']
+        self.agent_dependencies = [f for f in impresources.files(deps).iterdir() if f.name.endswith((".whl", ".tar.gz"))]
+        self.agent_name = agent.agent_name(self.camera_control_script, self.agent_dependencies, self.agent_modules)
+
+        # System packages required on the camera.
         self.required_packages = [
-            'getmac',
             'picamera2',
-            'blinker',
-            'click',
-            'itsdangerous',
-            'Jinja2',
-            'Werkzeug',
-            'MarkupSafe',
-            'Flask',
-            'Flask-Cors',
         ]
-        
+
+        # Provisioning of fresh cameras runs in parallel with bounded concurrency.
+        self.provisioning_workers = 8
+        self.provisioning_failures = {}
+
         # Create UDP multicast socket for sending messages.
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        self.udp_socket.bind(('', 0))
+        self.udp_socket.settimeout(0.5)
+
+        # Reliable command delivery state.
+        self.sequence = 0
+        self.pending_commands = {}
+        self.delivered_commands = {}
+        self.delivery = {}
+        self.ack_condition = threading.Condition()
+        self.retry_interval = 0.05
+
+        # Subnet probe used to find candidate cameras.
+        self.probe = SubnetProbe(ports=(22, 8002))
+
+        # Persistent record of cameras keyed by MAC address.
+        self.cache = DiscoveryCache()
 
         # Camera control thread storage.
         self.threads = []
         self.threads_running = threading.Event()
         self.threads_running.set()
         self.message_buffer = Queue()
+        self.recovery_report = {}
+        self.capture_scheduler = None
+        self.recovery_grace = 1.0
+        self.burst_reports = {}
+        self.schedule_reports = {}
+        self.image_receiver = ImageReceiver(TCP_PORT, directory="images", clock=self._clock_offset)
+        self.clock_requests = {}
+        self.clock_samples = {}
+        self.clock_offsets = {}  # Latest clock estimate of each camera by hostname, kept across rediscovery.
+        self.clock_sync_interval = 300.0
+        self.next_clock_sync = time.monotonic()
+        for target in (self._listen_on_UDP, self._retransmit_commands, self._sync_clocks_periodically):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
 
         # If a configuration file is provided, check the cameras are ready.
         if configuration is not None:
+            for camera in self.cameras:
+                self.cameras[camera]["http"] = False
             found_all_cameras = self._check_status()
-            # If any camera is not found, perform a network scan to update the configuration.
+            # If any camera is not found, relocate only the missing cameras.
             if not found_all_cameras:
-                self.find_cameras(id=self.id, password=self.password)
+                self._relocate_cameras()
+            self._update_cache()
 
     def __del__(self):
         self.log_message = "Stopping camera threads."
         log.debug(self.log_message)
+        self.threads_running.clear()
+        self.image_receiver.stop()
+        self.pool.stop()
         self.log_message = "Deleted Controller instance."
         log.debug(self.log_message)
 
@@ -121,7 +166,8 @@ class Controller:
         log.debug(self.log_message)
         self.cameras = configuration
         self.id = id
-        self.username = password
+        self.username = self.id
+        self.password = password
         self._check_status()
         return self.cameras
     
@@ -129,61 +175,383 @@ class Controller:
         self.log_message = "Clearing configuration."
         self.cameras = configuration
         self.id = id
-        self.username = password
+        self.username = self.id
+        self.password = password
         return self.cameras
 
-    def capture_images(self, name: str="IMG_", number: int=1, interval: float=0.0, recover: bool=False) -> bool:
+    def capture_images(self, name: str="IMG_", number: int=1, interval: float=0.0, recover: bool=False, wait: bool=False, stream: bool=False) -> bool:
+        if self.capture_scheduler is not None and self.capture_scheduler.running:
+            self.log_message = "Image capture already in progress."
+            self.frontend_log_messages.append(self.log_message)
+            log.warning(self.log_message)
+            return False
         try:
-            n = 1
-            while n <= number:
-                filename = "{name}_{n:02d}".format(name=name, n=n)
-                fmt = "jpg"
-                command = {"command": "captureFrame", "args": {"filename": filename, "format": fmt}}
-                capture_time = time.time()
-                self._send_command(command)
-                n += 1
-                self.log_message = "Capturing image {n} called {filename}...".format(n=n, filename=filename)
-                self.frontend_log_messages.append(self.log_message)
-                elapsed = capture_time - time.time()
-                sleep(interval-elapsed)
+            # Receive images pushed by the cameras as they are captured.
+            if stream:
+                self.image_receiver.start()
+
+            # Fire each capture at an absolute deadline in the background.
+            on_complete = lambda report: self._capture_complete(report, recover)
+            self.capture_scheduler = CaptureScheduler(lambda n: self._trigger_capture(name, n, stream), number, interval, on_complete=on_complete)
+            self.capture_scheduler.start()
+            if wait:
+                self.capture_scheduler.wait()
             return True
         except Exception:
             return False
+
+    def capture_burst(self, name: str="BURST_", count: int=10, rate: float=None, delay: float=0.5, stream: bool=False) -> None:
+        # Each camera captures the burst locally from a common start time, at most rate frames per second,
+        # and replies with the frame rate it achieved. Frames are held in memory during the burst, so cameras
+        # stop early once the frames fill their spool_bytes and report the burst as truncated.
+        if stream:
+            self.image_receiver.start()
+        self.burst_reports = {}
+        args = {"filename": name, "format": "jpg", "count": count, "rate": rate, "start": time.time() + delay, "stream": stream}
+        self._send_command({"command": "captureBurst", "args": args}, reliable=True)
+        self.log_message = "Capturing burst of {count} images called {name}...".format(count=count, name=name)
+        self.frontend_log_messages.append(self.log_message)
+        log.info(self.log_message)
+
+    def burst_status(self) -> dict:
+        # Reports of the last burst received from each camera.
+        return dict(self.burst_reports)
+
+    def start_schedule(self, name: str="TL_", interval: float=60.0, count: int=1, delay: float=1.0, stream: bool=False) -> None:
+        # Push a time-lapse to every camera once. Each camera runs it against its own clock, saves it so it
+        # survives restarts and keeps capturing if the controller or network goes away.
+        if stream:
+            self.image_receiver.start()
+        args = {"filename": name, "format": "jpg", "interval": interval, "count": count, "start": time.time() + delay, "stream": stream}
+        self._send_command({"command": "startSchedule", "args": args}, reliable=True)
+        self.log_message = "Started time-lapse of {count} images called {name} every {interval} s".format(count=count, name=name, interval=interval)
+        self.frontend_log_messages.append(self.log_message)
+        log.info(self.log_message)
+
+    def pause_schedule(self) -> None:
+        self._send_command({"command": "pauseSchedule"}, reliable=True)
+
+    def resume_schedule(self) -> None:
+        self._send_command({"command": "resumeSchedule"}, reliable=True)
+
+    def cancel_schedule(self) -> None:
+        self._send_command({"command": "cancelSchedule"}, reliable=True)
+
+    def schedule_status(self, timeout: float=2.0) -> dict:
+        # Ask every camera for the progress of its time-lapse and wait for the replies.
+        with self.ack_condition:
+            self.schedule_reports = {}
+        self._send_command({"command": "getSchedule"}, reliable=True)
+        with self.ack_condition:
+            self.ack_condition.wait_for(lambda: all(camera in self.schedule_reports for camera in self.cameras), timeout)
+            return dict(self.schedule_reports)
+
+    def sync_clocks(self, samples: int=8, spacing: float=0.05, timeout: float=1.0, push: bool=True) -> dict:
+        # NTP-style estimate of each camera's clock offset from ours. For each sample we note when the request was
+        # sent (t1) and the reply received (t4) and the camera reports when it received the request (t2) and sent
+        # the reply (t3), giving offset = ((t2 - t1) + (t3 - t4))/2 and delay = (t4 - t1) - (t3 - t2). The sample
+        # with the smallest delay is least affected by queueing so its offset is used.
+        cameras = {camera: self.cameras[camera]["ip"] for camera in self.cameras}
+        with self.ack_condition:
+            self.clock_requests = {}
+            self.clock_samples = {}
+        for n in range(samples):
+            for camera, ip_addr in cameras.items():
+                id = "{camera}-{n}-{time}".format(camera=camera, n=n, time=time.monotonic())
+                with self.ack_condition:
+                    self.clock_requests[id] = time.time()
+                self._send_unicast(ip_addr, {"command": "syncClock", "args": {"id": id}})
+            time.sleep(spacing)
+        with self.ack_condition:
+            self.ack_condition.wait_for(lambda: len(self.clock_requests) == 0, timeout)
+            collected = dict(self.clock_samples)
+            self.clock_requests = {}
+
+        results = {}
+        for camera, camera_samples in collected.items():
+            if camera not in self.cameras:
+                continue
+            estimates = [(((s["t2"] - s["t1"]) + (s["t3"] - s["t4"]))/2, (s["t4"] - s["t1"]) - (s["t3"] - s["t2"])) for s in camera_samples]
+            # A round trip outside 0 to timeout means the camera reported inconsistent times, so never use it.
+            estimates = [(offset, delay) for offset, delay in estimates if 0 <= delay <= timeout]
+            if len(estimates) == 0:
+                continue
+            offset, delay = min(estimates, key=lambda estimate: estimate[1])
+            results[camera] = {"offset": offset, "delay": delay, "samples": len(estimates), "time": time.time()}
+            self.cameras[camera]["clock"] = results[camera]
+            self.clock_offsets[camera] = results[camera]
+            self.log_message = "Clock of {camera} is {offset:+.4f} s from controller (round trip {delay:.4f} s)".format(camera=camera, offset=offset, delay=delay)
+            log.debug(self.log_message)
+        for camera in set(cameras) - set(results):
+            self.log_message = "No valid clock sync replies from {camera}".format(camera=camera)
+            log.warning(self.log_message)
+
+        # Let the cameras convert capture times sent by the controller to their own clocks.
+        if push and len(results) > 0:
+            offsets = {camera: result["offset"] for camera, result in results.items()}
+            self._send_command({"command": "setClockOffset", "args": {"offsets": offsets}}, reliable=True, targets=list(offsets))
+        return results
+
+    def update_controls(self, controls: dict, capture: str=None) -> None:
+        # Set camera controls on every camera, optionally capturing an image in the same datagram once applied.
+        commands = [{"command": "updateControls", "args": controls}]
+        if capture is not None:
+            commands.append({"command": "captureFrame", "args": {"filename": capture, "format": "jpg", "time": time.time()}})
+        self._send_command(commands, reliable=True)
+
+    def cancel_capture(self) -> None:
+        if self.capture_scheduler is not None:
+            self.capture_scheduler.cancel()
+            self.log_message = "Image capture cancelled."
+            self.frontend_log_messages.append(self.log_message)
+            log.info(self.log_message)
+
+    def capture_status(self) -> dict:
+        if self.capture_scheduler is None:
+            return {}
+        return self.capture_scheduler.report()
+
+    def stream_status(self) -> dict:
+        # Images received from cameras streaming during capture.
+        return self.image_receiver.stats()
+
+    def _trigger_capture(self, name: str, n: int, stream: bool=False) -> None:
+        filename = protocol.series_name(name, n)
+        fmt = "jpg"
+        command = {"command": "captureFrame", "args": {"filename": filename, "format": fmt, "time": time.time(), "stream": stream}}
+        self._send_command(command, reliable=True)
+        self.log_message = "Capturing image {n} called {filename}...".format(n=n, filename=filename)
+        self.frontend_log_messages.append(self.log_message)
+        log.debug(self.log_message)
+
+    def _capture_complete(self, report: dict, recover: bool) -> None:
+        self.log_message = "Captured {fired} of {number} images ({missed} missed deadlines, max jitter {max_jitter:.4f} s).".format(**report)
+        self.frontend_log_messages.append(self.log_message)
+        log.info(self.log_message)
+        if recover:
+            # Only recover once the cameras have received the last capture and written it to storage.
+            self._wait_for_captures()
+            self.recover_images()
+
+    def _wait_for_captures(self, timeout: float=10.0) -> None:
+        # Wait for outstanding commands to be acknowledged, then for each camera to finish running them and
+        # empty its image spool.
+        deadline = time.monotonic() + timeout
+        with self.ack_condition:
+            self.ack_condition.wait_for(lambda: len(self.pending_commands) == 0, timeout)
+        waiting = set(self.cameras)
+        grace = False
+        while len(waiting) > 0 and time.monotonic() < deadline:
+            status = self.camera_status()
+            for camera in list(waiting):
+                if status.get(camera) is None:
+                    # No status from this camera, so allow a grace period for the write instead.
+                    grace = True
+                    waiting.discard(camera)
+                elif status[camera].get("commands", {}).get("in_flight", 0) == 0 and status[camera].get("spool", {}).get("queued", 0) == 0:
+                    # Every acknowledged capture has run and its image has been written.
+                    waiting.discard(camera)
+            if len(waiting) > 0:
+                time.sleep(0.2)
+        if grace:
+            time.sleep(self.recovery_grace)
         
-    def recover_images(self):
+    def recover_images(self, workers: int=4, bulk: bool=False, delete: bool=False) -> dict:
         self.log_message = "Initiating image recovery..."
         self.frontend_log_messages.append(self.log_message)
         log.info(self.log_message)
-        for camera in self.cameras:
-            ip_addr = self.cameras[camera]['ip']
-            self.log_message = "Recovering images from {camera} at {ip_addr}".format(camera=camera, ip_addr=ip_addr)
+        self.recovery_report = {}
+
+        # Recover images from several cameras at once using a bounded ThreadPool.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = {executor.submit(self._recover_camera_images, camera, bulk, delete): camera for camera in self.cameras}
+            for future in concurrent.futures.as_completed(results):
+                camera = results[future]
+                report = future.result()
+                self.log_message = "Recovered {recovered} of {total} images from {camera} ({skipped} already recovered, {failed} failed) at {throughput:.2f} MB/s".format(camera=camera, **report)
+                self.frontend_log_messages.append(self.log_message)
+                log.info(self.log_message)
+        return self.recovery_report
+
+    def _recover_camera_images(self, camera: str, bulk: bool=False, delete: bool=False) -> dict:
+        ip_addr = self.cameras[camera]['ip']
+        directory = os.path.join("images", camera)
+        report = {"ip": ip_addr, "total": 0, "recovered": 0, "skipped": 0, "failed": 0, "deleted": 0, "bytes": 0, "elapsed": 0.0, "throughput": 0.0}
+        self.recovery_report[camera] = report
+        self.log_message = "Recovering images from {camera} at {ip_addr}".format(camera=camera, ip_addr=ip_addr)
+        self.frontend_log_messages.append(self.log_message)
+        log.info(self.log_message)
+        try:
+            with self._connection(ip_addr) as c:
+                remote_images = self._list_remote_images(c)
+                if len(remote_images) == 0:
+                    self.log_message = "No images to recover from {camera}".format(camera=camera)
+                    self.frontend_log_messages.append(self.log_message)
+                    log.warning(self.log_message)
+                    return report
+                os.makedirs(directory, exist_ok=True)
+                images, verified = self._select_images_to_recover(c, remote_images, directory)
+                report["total"] = len(remote_images)
+                report["skipped"] = len(verified)
+                if bulk:
+                    checksums = self._get_images_archive(c, camera, images, remote_images, directory, report)
+                else:
+                    checksums = self._get_images(c, camera, images, remote_images, directory, report)
+                if delete:
+                    verified.extend(self._verify_recovered_images(c, checksums, directory))
+                    report["deleted"] = self._delete_remote_images(c, verified)
+        except Exception:
+            self.log_message = "Failed to recover images from {camera} at {ip_addr}".format(camera=camera, ip_addr=ip_addr)
             self.frontend_log_messages.append(self.log_message)
-            log.info(self.log_message)
-            c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
+            log.warning(self.log_message)
+        return report
+
+    def _get_images(self, c, camera: str, images: list, remote_images: dict, directory: str, report: dict) -> dict:
+        # Recover images one at a time over SFTP.
+        checksums = {}
+        start_time = time.monotonic()
+        for image in images:
+            destination = os.path.join(directory, image)
+            partial = destination + ".part"
+            log.debug("Recovering image {image} from {camera}".format(image=image, camera=camera))
             try:
-                result = c.sudo("ls *.jpg", hide=True)
-                image_list_str = result.stdout
-                image_list = image_list_str.splitlines()
-                for image in image_list:
-                    destination = "images/{camera}/{image}".format(camera=camera, image=image)
-                    self.log_message = "Recovering image {image} from {camera} at {ip_addr}".format(image=image, camera=camera, ip_addr=ip_addr)
-                    self.frontend_log_messages.append(self.log_message)
-                    log.info(self.log_message)
-                    c.get("/home/{username}/{image}".format(username=self.username, image=image), destination)
+                # Download to a partial file so an interrupted transfer is never mistaken for a complete image.
+                c.get("/home/{username}/{image}".format(username=self.username, image=image), partial)
+                os.replace(partial, destination)
+                checksums[image] = None
+                report["recovered"] += 1
+                report["bytes"] += remote_images[image]
             except Exception:
-                self.log_message = "No images to recover..."
-                self.frontend_log_messages.append(self.log_message)
+                report["failed"] += 1
+                self.log_message = "Failed to recover image {image} from {camera}".format(image=image, camera=camera)
                 log.warning(self.log_message)
-                sleep(2)
-            c.close()
+            self._update_throughput(report, start_time)
+        return checksums
+
+    def _get_images_archive(self, c, camera: str, images: list, remote_images: dict, directory: str, report: dict) -> dict:
+        # Stream all images as a single tar archive over one SSH channel and unpack each member as it arrives.
+        checksums = {}
+        if len(images) == 0:
+            return checksums
+        start_time = time.monotonic()
+        wanted = set(images)
+        stdin, stdout, stderr = c.client.exec_command("tar -cf - -C /home/{username} -T -".format(username=self.username))
+        stdin.write("\n".join(images) + "\n")
+        stdin.flush()
+        stdin.channel.shutdown_write()
+        with tarfile.open(fileobj=stdout, mode="r|") as archive:
+            for member in archive:
+                image = os.path.basename(member.name)
+                if not member.isfile() or image not in wanted:
+                    continue
+                destination = os.path.join(directory, image)
+                partial = destination + ".part"
+                md5 = hashlib.md5()
+                source = archive.extractfile(member)
+                with open(partial, "wb") as f:
+                    for chunk in iter(lambda: source.read(1 << 20), b""):
+                        f.write(chunk)
+                        md5.update(chunk)
+                os.replace(partial, destination)
+                checksums[image] = md5.hexdigest()
+                report["recovered"] += 1
+                report["bytes"] += member.size
+                self._update_throughput(report, start_time)
+        if stdout.channel.recv_exit_status() != 0:
+            self.log_message = "Archive transfer from {camera} reported errors: {error}".format(camera=camera, error=stderr.read().decode().strip())
+            log.warning(self.log_message)
+        report["failed"] += len(images) - len(checksums)
+        return checksums
+
+    def _update_throughput(self, report: dict, start_time: float) -> None:
+        report["elapsed"] = time.monotonic() - start_time
+        if report["elapsed"] > 0:
+            report["throughput"] = report["bytes"]/report["elapsed"]/1e6
+
+    def _list_remote_images(self, c) -> dict:
+        # List the images in the home directory of the RPi with their sizes in bytes.
+        cmd = "find /home/{username} -maxdepth 1 -type f -name '*.jpg' -printf '%s %f\\n'".format(username=self.username)
+        result = c.run(cmd, hide=True, warn=True)
+        images = {}
+        for line in result.stdout.splitlines():
+            size, _, image = line.partition(" ")
+            if image:
+                images[image] = int(size)
+        return dict(sorted(images.items()))
+
+    def _select_images_to_recover(self, c, remote_images: dict, directory: str) -> list | list:
+        # Images already recovered with a matching size are confirmed by checksum before being skipped.
+        candidates = []
+        for image, size in remote_images.items():
+            destination = os.path.join(directory, image)
+            if os.path.isfile(destination) and os.path.getsize(destination) == size:
+                candidates.append(image)
+        remote_checksums = self._remote_checksums(c, candidates)
+        verified = [image for image in candidates if remote_checksums.get(image) == self._md5(os.path.join(directory, image))]
+        images = [image for image in remote_images if image not in set(verified)]
+        return images, verified
+
+    def _verify_recovered_images(self, c, checksums: dict, directory: str) -> list:
+        # Compare the checksums of recovered images with those of the originals on the RPi.
+        camera_checksums = self._remote_checksums(c, list(checksums))
+        verified = []
+        for image, checksum in checksums.items():
+            if checksum is None:
+                checksum = self._md5(os.path.join(directory, image))
+            if camera_checksums.get(image) == checksum:
+                verified.append(image)
+        return verified
+
+    def _remote_checksums(self, c, images: list) -> dict:
+        # Checksum images on the RPi in batches to bound the command length.
+        checksums = {}
+        batch_size = 500
+        for i in range(0, len(images), batch_size):
+            batch = " ".join(shlex.quote(image) for image in images[i:i+batch_size])
+            result = c.run("cd /home/{username} && md5sum -- {batch}".format(username=self.username, batch=batch), hide=True, warn=True)
+            for line in result.stdout.splitlines():
+                checksum, _, image = line.partition("  ")
+                checksums[image] = checksum
+        return checksums
+
+    def _delete_remote_images(self, c, images: list) -> int:
+        # Delete images from the RPi only once their recovered copies have been verified.
+        batch_size = 500
+        deleted = 0
+        for i in range(0, len(images), batch_size):
+            batch = images[i:i+batch_size]
+            result = c.run("cd /home/{username} && rm -f -- {batch}".format(username=self.username, batch=" ".join(shlex.quote(image) for image in batch)), hide=True, warn=True)
+            if result.ok:
+                deleted += len(batch)
+        self.log_message = "Deleted {deleted} verified images from {ip_addr}".format(deleted=deleted, ip_addr=c.host)
+        log.info(self.log_message)
+        return deleted
+
+    def _md5(self, filename: str) -> str:
+        md5 = hashlib.md5()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                md5.update(chunk)
+        return md5.hexdigest()
 
-    
     def reboot_cameras(self):
         for camera in self.cameras:
             ip_addr = self.cameras[camera]['ip']
             self._reboot_camera(ip_addr)
 
-    def find_cameras(self, id: str, network: str=None, password: str=None) -> dict:
+    def find_cameras(self, id: str, network: str | list=None, password: str=None, discovery: str="hybrid", window: float=2.0) -> dict:
+        # Discovery modes: "multicast" only collects replies from running camera agents, "ssh" logs in to
+        # every host on the network and "hybrid" only uses SSH for hosts that did not answer the multicast.
+        # Cameras that answer the multicast with an outdated agent are updated via SSH in every mode.
+        for _ in self.iter_cameras(id, network=network, password=password, discovery=discovery, window=window):
+            pass
+        return self.cameras
+
+    def iter_cameras(self, id: str, network: str | list=None, password: str=None, discovery: str="hybrid", window: float=2.0):
+        # Generator variant of find_cameras that yields a "found" event as soon as each camera is identified,
+        # a "ready" event once it is ready for acquisition and a final "done" event with all cameras.
+        start_time = time.monotonic()
+
         # Frontend log messages.
         self.frontend_log_messages = []
 
@@ -194,75 +562,188 @@ class Controller:
         if  self.password == None:
             self._set_ssh_credentials()
 
-        # Scan network for valid IP addresses with devices.
+        # Collect replies from camera agents that are already running.
+        self.cameras = {}
+        if discovery in ("multicast", "hybrid"):
+            for event in self._iter_cameras_multicast(id, window):
+                self.cameras.setdefault(event["camera"], {}).update(event["info"])
+                yield event
+
+        # Provision cameras that did not answer via SSH.
+        if discovery in ("ssh", "hybrid"):
+            exclude = set(camera["ip"] for camera in self.cameras.values())
+            for event in self._iter_cameras_ssh(id, network, exclude=exclude):
+                self.cameras.setdefault(event["camera"], {}).update(event["info"])
+                yield event
+
+        self.discovery_time = time.monotonic() - start_time
+        self.log_message = "Discovered {n} cameras in {time:.2f} s".format(n=len(self.cameras), time=self.discovery_time)
+        self.frontend_log_messages.append(self.log_message)
+        log.info(self.log_message)
+
+        if len(self.cameras) > 0:
+            # Check status of cameras communications.
+            self._check_status()
+        else:
+            self.log_message = "No RPi cameras found on the network."
+            self.frontend_log_messages.append(self.log_message)
+            log.warning(self.log_message)
+        self._update_cache()
+        # Discovery may have restarted agents, which forget their clock offsets, so resync straight away.
+        for camera in self.cameras:
+            if camera in self.clock_offsets:
+                self.cameras[camera]["clock"] = self.clock_offsets[camera]
+        self.next_clock_sync = time.monotonic()
+        yield {"event": "done", "cameras": copy.deepcopy(self.cameras), "time": self.discovery_time}
+
+    def _iter_cameras_multicast(self, id: str, window: float):
+        # Collect hostname, IP and MAC address replies from camera agents over multicast within the window.
+        self.log_message = "Discovering cameras via multicast."
+        self.frontend_log_messages.append(self.log_message)
+        log.info(self.log_message)
+        found = set()
+        outdated = {}
+        for response in self._collect_responses(window):
+            hostname = response["hostname"]
+            if id in hostname and hostname not in found:
+                found.add(hostname)
+                self.log_message = "RPi camera called {name} answered from {ip} with MAC address: {mac}".format(name=hostname, ip=response["ip"], mac=response["mac"])
+                self.frontend_log_messages.append(self.log_message)
+                log.info(self.log_message)
+                if response.get("agent") == self.agent_name:
+                    # The current agent is already running, so the camera is ready as soon as it answers.
+                    info = {"ip": response["ip"], "mac": response["mac"], "ready": True, "http": True}
+                    yield {"event": "found", "camera": hostname, "info": info}
+                    yield {"event": "ready", "camera": hostname, "info": info}
+                else:
+                    # An older agent or camera.py is running, so deploy the current agent once the window closes.
+                    outdated[hostname] = response
+                    yield {"event": "found", "camera": hostname, "info": {"ip": response["ip"], "mac": response["mac"], "ready": False, "http": False}}
+
+        # Update the agent on outdated cameras using a ThreadPool.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.provisioning_workers) as provisioner:
+            checks = {provisioner.submit(self._check_RPi, response["ip"], True, response["mac"]): hostname for hostname, response in outdated.items()}
+            for future in concurrent.futures.as_completed(checks):
+                hostname = checks[future]
+                ready, ip = future.result()
+                if ready:
+                    self.log_message = "Updated camera agent at {ip}".format(ip=ip)
+                    self.frontend_log_messages.append(self.log_message)
+                    log.info(self.log_message)
+                    yield {"event": "ready", "camera": hostname, "info": {"ready": True}}
+                else:
+                    self.log_message = "Camera not ready for acquisition at {ip}".format(ip=ip)
+                    log.warning(self.log_message)
+                    yield {"event": "failed", "camera": hostname, "info": {"ready": False}, "error": self.provisioning_failures.get(ip)}
+
+    def _collect_responses(self, timeout: float, done=lambda: False):
+        # Send get_hostname_ip_mac with exponential resend backoff and yield each response until done or the timeout expires.
+        cmd = {"command": "get_hostname_ip_mac"}
+        deadline = time.monotonic() + timeout
+        resend_interval = 0.1
+        next_send = time.monotonic()
+        while not done():
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_send:
+                self._send_command(cmd)
+                next_send = now + resend_interval
+                resend_interval = min(2*resend_interval, 1.0)
+            try:
+                message = self.message_buffer.get(timeout=min(next_send, deadline) - now)
+                response = message["response"]
+                response["hostname"]
+            except Empty:
+                continue
+            except (KeyError, TypeError):
+                continue
+            yield response
+
+    def _iter_cameras_ssh(self, id: str, network: str | list=None, exclude: set=set()):
+        # Probe one or more networks for devices accepting SSH connections.
         if network == None:
-            mask = '255.255.255.0'
-            address = self.ip + '/' + mask
-            itf = ipaddress.ip_interface(address)
-            network = itf.network
+            network = self._default_network()
         self.log_message = "Searching network: {network}".format(network=network)
         self.frontend_log_messages.append(self.log_message)
         log.info(self.log_message)
-        scan = networkscan.Networkscan(network)
-        scan.run()
+        found = self.probe.run(network)
+        hosts = [ip_addr for ip_addr, ports in found.items() if 22 in ports]
+        self.log_message = "Probed {n} addresses in {time:.2f} s and found {found} SSH hosts".format(n=self.probe.stats["hosts"], time=self.probe.stats["elapsed"], found=len(hosts))
+        self.frontend_log_messages.append(self.log_message)
+        log.info(self.log_message)
 
-        # Check hostname of devices using ThreadPool.
-        self.cameras = {}
-        results = []
-        hostname = ""
-        ip = ""
-        mac = ""
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            for ip_addr in scan.list_of_hosts_found:
+        # Check hostname of devices that are not already known cameras and check the control script and
+        # packages of each camera as soon as it is identified using ThreadPools.
+        hostname_checks = []
+        rpi_checks = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=32) as executor, concurrent.futures.ThreadPoolExecutor(max_workers=self.provisioning_workers) as provisioner:
+            for ip_addr in hosts:
+                if ip_addr in exclude:
+                    continue
                 self.log_message = "Checking IP address: {ip_addr}".format(ip_addr=ip_addr)
                 self.frontend_log_messages.append(self.log_message)
                 log.debug(self.log_message)
-                results.append(executor.submit(self._check_hostname, ip_addr, id))
-            for future in concurrent.futures.as_completed(results):
-                found = future.result()[0]
-                hostname = future.result()[1]
-                ip = future.result()[2]
-                if found:
-                    mac = getmac.get_mac_address(ip=ip)
-                    self.cameras.update({hostname: {"ip": ip, "mac": mac, "ready": False, "http": False}})
-                    self.log_message = "RPi camera called {name} found at {ip} with MAC address: {mac}".format(name=hostname, ip=ip, mac=mac)
-                    self.frontend_log_messages.append(self.log_message)
-                    log.info(self.log_message)
-                else:
-                    self.log_message = "No RPi camera found at {ip}".format(ip=ip)
-                    self.frontend_log_messages.append(self.log_message)
-                    log.debug(self.log_message)
-    
-        # If cameras are found, check control script and packages using ThreadPool.
-        if len(self.cameras) > 0:
-            log.debug("Checking control script is installed.")
-            results = []
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                for camera in self.cameras:
-                    ip_addr = self.cameras[camera]["ip"]
-                    results.append(executor.submit(self._check_RPi, ip_addr))
-                for future in concurrent.futures.as_completed(results):
-                    ready = future.result()[0]
-                    ip = future.result()[1]
-                    if ready:
-                        ready = True
-                        self.log_message ="Camera ready for acquisiton at {ip}".format(ip=ip)
+                hostname_checks.append(executor.submit(self._check_hostname, ip_addr, id))
+            pending = set(hostname_checks)
+            while len(pending) > 0:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in rpi_checks:
+                        camera = rpi_checks[future]
+                        ready, ip = future.result()
+                        if ready:
+                            self.log_message ="Camera ready for acquisiton at {ip}".format(ip=ip)
+                            self.frontend_log_messages.append(self.log_message)
+                            log.info(self.log_message)
+                            yield {"event": "ready", "camera": camera, "info": {"ready": True}}
+                        else:
+                            self.log_message = "Camera not ready for acquisition at {ip}".format(ip=ip)
+                            log.warning(self.log_message)
+                            yield {"event": "failed", "camera": camera, "info": {"ready": False}, "error": self.provisioning_failures.get(ip)}
+                        continue
+                    found, hostname, ip = future.result()
+                    if found:
+                        mac = getmac.get_mac_address(ip=ip)
+                        self.log_message = "RPi camera called {name} found at {ip} with MAC address: {mac}".format(name=hostname, ip=ip, mac=mac)
                         self.frontend_log_messages.append(self.log_message)
                         log.info(self.log_message)
+                        check = provisioner.submit(self._check_RPi, ip, False, mac)
+                        rpi_checks[check] = hostname
+                        pending.add(check)
+                        yield {"event": "found", "camera": hostname, "info": {"ip": ip, "mac": mac, "ready": False, "http": False}}
                     else:
-                        ready = False
-                        self.log_message = "Camera not ready for acquisition at {ip}".format(ip=ip)
-                        log.warning(self.log_message)
-                    self.cameras[camera]["ready"] = ready
+                        self.log_message = "No RPi camera found at {ip}".format(ip=ip)
+                        self.frontend_log_messages.append(self.log_message)
+                        log.debug(self.log_message)
 
-            # Check status of cameras communications.
-            self._check_status()
-            return self.cameras
-        else:
-            self.log_message = "No RPi cameras found on the network."
-            self.frontend_log_messages.append(self.log_message)
-            log.warning(self.log_message)
-            return self.cameras
+    def configure_cameras(self, mode: str="still", preview_size: tuple=(640, 480), preview_fps: int=10) -> None:
+        # Update the startup configuration of each camera and restart it to apply.
+        configuration = {"mode": mode, "preview_size": list(preview_size), "preview_fps": preview_fps}
+        for camera in self.cameras:
+            ip_addr = self.cameras[camera]["ip"]
+            self._install_camera_configuration(ip_addr, configuration)
+            self._run_launch_script(ip_addr)
+
+    def camera_status(self) -> dict:
+        # Query the status endpoint of each camera agent.
+        status = {}
+        for camera in self.cameras:
+            ip_addr = self.cameras[camera]["ip"]
+            try:
+                response = requests.get("http://{ip_addr}:8002/status".format(ip_addr=ip_addr), timeout=2)
+                status[camera] = response.json()
+            except Exception:
+                self.log_message = "Failed to get status of {camera} at {ip_addr}".format(camera=camera, ip_addr=ip_addr)
+                log.warning(self.log_message)
+                status[camera] = None
+        return status
+
+    def connection_stats(self) -> dict:
+        stats = self.pool.stats()
+        self.log_message = "SSH handshakes opened: {opened}, saved: {saved}".format(opened=stats["handshakes_opened"], saved=stats["handshakes_saved"])
+        log.debug(self.log_message)
+        return stats
 
     def save_configuration(self) -> None:
         filename = self.id + ".json"
@@ -291,60 +772,319 @@ class Controller:
             log.info(self.log_message)
         time.sleep(1)
 
-    def _check_status(self) -> bool:
-        # Check HTTP connection for each camera in a separate thread.
-        found_all_cameras = False
+    def _default_network(self) -> ipaddress.IPv4Network:
+        # Assume a /24 network around the controller address.
+        mask = '255.255.255.0'
+        address = self.ip + '/' + mask
+        itf = ipaddress.ip_interface(address)
+        return itf.network
+
+    def _relocate_cameras(self, network: str | list=None) -> bool:
+        # Locate cameras that did not answer from their MAC address using the ARP table, cached and
+        # configured addresses, probing only those candidates. If any are still missing, probe the
+        # network once to refresh the ARP table and try again, rather than logging in to every host.
+        missing = [camera for camera in self.cameras if not self.cameras[camera]["http"]]
+        self.log_message = "Relocating {n} missing cameras.".format(n=len(missing))
+        self.frontend_log_messages.append(self.log_message)
+        log.info(self.log_message)
+        if self.password == None:
+            self._set_ssh_credentials()
+        missing = self._locate_cameras(missing, neighbours(), use_cache=True)
+        if len(missing) > 0:
+            self.probe.run(network if network is not None else self._default_network())
+            missing = self._locate_cameras(missing, neighbours(), use_cache=False)
+        for camera in missing:
+            self.cameras[camera]["ready"] = False
+            self.log_message = "Camera {name} could not be located.".format(name=camera)
+            self.frontend_log_messages.append(self.log_message)
+            log.warning(self.log_message)
+
+        # Check status of relocated cameras communications.
+        if len(missing) < len([camera for camera in self.cameras if not self.cameras[camera]["http"]]):
+            self._check_status()
+        return len(missing) == 0
 
-        # Send command via UDP to get MAC address of found devices and await response via HTTP request.
+    def _locate_cameras(self, cameras: list, table: dict, use_cache: bool) -> list:
+        # Probe candidate addresses for each camera and confirm the hostname via SSH. Returns the cameras not located.
+        candidates = {}
+        for camera in cameras:
+            mac = (self.cameras[camera].get("mac") or "").lower()
+            addresses = [table.get(mac)]
+            if use_cache:
+                entry = self.cache.get(mac) or {}
+                addresses += [entry.get("ip"), self.cameras[camera]["ip"]]
+            candidates[camera] = list(dict.fromkeys(ip for ip in addresses if ip is not None))
+        found = self.probe.run(sorted(set(ip for addresses in candidates.values() for ip in addresses)))
+        missing = []
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            checks = {}
+            for camera, addresses in candidates.items():
+                addresses = [ip for ip in addresses if 22 in found.get(ip, [])]
+                if len(addresses) == 0:
+                    missing.append(camera)
+                    continue
+                checks[camera] = [executor.submit(self._check_hostname, ip, camera) for ip in addresses]
+            for camera, futures in checks.items():
+                located = [ip for ok, hostname, ip in (future.result() for future in futures) if ok and hostname == camera]
+                if len(located) == 0:
+                    missing.append(camera)
+                    continue
+                if located[0] != self.cameras[camera]["ip"]:
+                    self.log_message = "Camera {name} moved from {old} to {new}".format(name=camera, old=self.cameras[camera]["ip"], new=located[0])
+                    self.frontend_log_messages.append(self.log_message)
+                    log.info(self.log_message)
+                    self.cameras[camera]["ip"] = located[0]
+                ready, _ = self._check_RPi(located[0], mac=self.cameras[camera].get("mac"))
+                self.cameras[camera]["ready"] = ready
+        return missing
+
+    def _update_cache(self) -> None:
+        # Record the last address of every camera that answered.
+        for camera in self.cameras:
+            if self.cameras[camera].get("http"):
+                self.cache.update(self.cameras[camera].get("mac"), hostname=camera, ip=self.cameras[camera]["ip"])
+        self.cache.save()
+
+    def _check_status(self, timeout: float=5.0) -> bool:
+        # Send command via UDP to get MAC address of found devices and await responses until
+        # every camera has answered or the timeout expires.
         self.log_message = "Sending UDP command to get MAC addresses."
         log.debug(self.log_message)
-        cmd = {"command": "get_hostname_ip_mac"}
-        self.http_responses = 0
-        timeout = 5.0
-        start_time = time.time()
-        elapsed_time = 0.0
-        while elapsed_time < timeout and self.http_responses < len(self.cameras):
-            elapsed_time = time.time() - start_time
-            self._send_command(cmd)
-            time.sleep(1)
-            while not self.message_buffer.empty():
-                message = self.message_buffer.get()
-                hostname = message["response"]["hostname"]
-                if self.cameras[hostname]["http"] == False:
+        waiting = set(camera for camera in self.cameras if not self.cameras[camera]["http"])
+
+        # Check each responding camera is running via SSH in parallel using a ThreadPool.
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            for response in self._collect_responses(timeout, done=lambda: len(waiting) == 0):
+                hostname = response["hostname"]
+                if hostname in waiting:
+                    waiting.discard(hostname)
+                    if response.get("ip") and response["ip"] != self.cameras[hostname]["ip"]:
+                        # DHCP address changed since the configuration was saved.
+                        self.log_message = "Camera {name} moved from {old} to {new}".format(name=hostname, old=self.cameras[hostname]["ip"], new=response["ip"])
+                        self.frontend_log_messages.append(self.log_message)
+                        log.info(self.log_message)
+                        self.cameras[hostname]["ip"] = response["ip"]
                     ip_addr = self.cameras[hostname]["ip"]
                     self.cameras[hostname]["http"] = True    # HTTP connection working so set flag True.
-                    self.cameras[hostname]["ready"] = self._check_camera_running(ip_addr) # Check camera.
-                    self.http_responses += 1
-                    self.log_message = "Camera at {ip} is ready for acquisition via HTTP".format(ip=ip_addr)
-                    self.frontend_log_messages.append(self.log_message)
-                    log.info(self.log_message) 
+                    results[executor.submit(self._check_camera_running, ip_addr)] = hostname
+            for future in concurrent.futures.as_completed(results):
+                hostname = results[future]
+                self.cameras[hostname]["ready"] = bool(future.result())
+                self.log_message = "Camera at {ip} is ready for acquisition via HTTP".format(ip=self.cameras[hostname]["ip"])
+                self.frontend_log_messages.append(self.log_message)
+                log.info(self.log_message) 
 
         # Check all cameras have been found.
-        found_all_cameras = True
-        for camera in self.cameras:
-            if self.cameras[camera]["http"] == False:
-                found_all_cameras = False
-                break
-        
+        found_all_cameras = len(waiting) == 0
         return found_all_cameras
 
-    def _send_command(self, command: str) -> None:
+    def _clock_offset(self, camera: str) -> float:
+        # Offset of the camera clock from the controller clock, or zero if not yet measured.
+        return self.clock_offsets.get(camera, {}).get("offset", 0.0)
+
+    def _sync_clocks_periodically(self) -> None:
+        # Re-estimate clock offsets at a fixed interval while there are cameras, or sooner when requested.
+        while self.threads_running.is_set():
+            time.sleep(0.5)
+            if time.monotonic() < self.next_clock_sync or len(self.cameras) == 0:
+                continue
+            try:
+                self.sync_clocks()
+            except Exception as e:
+                log.warning("Clock sync failed: {e}".format(e=e))
+            self.next_clock_sync = time.monotonic() + self.clock_sync_interval
+
+    def _send_unicast(self, ip_addr: str, command: dict) -> None:
+        # Send a single unreliable command directly to one camera.
+        with self.ack_condition:
+            self.sequence += 1
+            envelope = {"id": "{ip}-{seq}".format(ip=self.ip, seq=self.sequence), "seq": self.sequence, "commands": [command]}
+            sequence = self.sequence
+        try:
+            for datagram in protocol.encode(envelope, sequence):
+                self.udp_socket.sendto(datagram, (ip_addr, MCAST_PORT))
+        except Exception as e:
+            log.error(e)
+
+    def _send_command(self, command: dict | list, reliable: bool=False, targets: list=None, deadline: float=1.0, wait: bool=False) -> dict | None:
+        # Pack one or more commands into an envelope tagged with an id and sequence number so
+        # cameras can acknowledge it and ignore duplicates. Commands in a batch run in order.
+        commands = command if isinstance(command, list) else [command]
+        with self.ack_condition:
+            self.sequence += 1
+            command = {"id": "{ip}-{seq}".format(ip=self.ip, seq=self.sequence), "seq": self.sequence, "commands": commands}
+            sequence = self.sequence
         try: 
-            json_command = json.dumps(command, indent=2)
-            self.udp_socket.sendto(bytes(json_command, 'utf-8'), (MCAST_GRP, MCAST_PORT))
+            data = protocol.encode(command, sequence)
+            if reliable:
+                now = time.monotonic()
+                targets = list(self.cameras) if targets is None else list(targets)
+                with self.ack_condition:
+                    self.pending_commands[command["id"]] = {
+                        "data": data,
+                        "targets": set(targets),
+                        "acked": {},
+                        "sent": now,
+                        "deadline": now + deadline,
+                        "retry": now + self.retry_interval,
+                        "retransmitted": set(),
+                    }
+            for datagram in data:
+                self.udp_socket.sendto(datagram, (MCAST_GRP, MCAST_PORT))
         except Exception as e: 
-            log.error(e.with_traceback())
+            log.error(e)
+            return None
+        if reliable and wait:
+            return self._wait_for_acks(command["id"])
+        return None
+
+    def _wait_for_acks(self, id: str) -> dict:
+        # Block until every target has acknowledged the command or its deadline has passed.
+        with self.ack_condition:
+            self.ack_condition.wait_for(lambda: id not in self.pending_commands)
+            return self.delivered_commands.get(id)
+
+    def _retransmit_commands(self) -> None:
+        # Retransmit unacknowledged commands by unicast to the cameras that have not acknowledged them.
+        while self.threads_running.is_set():
+            time.sleep(self.retry_interval/2)
+            now = time.monotonic()
+            resend = []
+            with self.ack_condition:
+                for id, pending in list(self.pending_commands.items()):
+                    missing = pending["targets"] - set(pending["acked"])
+                    if len(missing) == 0 or now >= pending["deadline"]:
+                        self._complete_command(id, pending)
+                    elif now >= pending["retry"]:
+                        resend.extend((pending["data"], camera) for camera in missing if camera in self.cameras)
+                        pending["retransmitted"].update(missing)
+                        pending["retry"] = now + self.retry_interval
+            for data, camera in resend:
+                try:
+                    for datagram in data:
+                        self.udp_socket.sendto(datagram, (self.cameras[camera]["ip"], MCAST_PORT))
+                except Exception as e:
+                    log.debug(e)
 
-    def _check_RPi(self, ip_addr: str) -> bool | str:
-        installed = self._check_camera_control_script(ip_addr)
-        if not installed:
-            # Raspberry Pi hasn't been used as a camera before.
-            log.warning("Checking RPi OS on {ip_addr}".format(ip_addr=ip_addr))
+    def _complete_command(self, id: str, pending: dict) -> None:
+        # Update the per-camera delivery statistics. Called with ack_condition held.
+        del self.pending_commands[id]
+        for camera in pending["targets"]:
+            stats = self.delivery.setdefault(camera, {"sent": 0, "acked": 0, "retransmitted": 0, "rate": 0.0, "rtt": None})
+            stats["sent"] += 1
+            if camera in pending["retransmitted"]:
+                stats["retransmitted"] += 1
+            if camera in pending["acked"]:
+                stats["acked"] += 1
+                # Only acknowledgements of the original transmission give an unambiguous round trip time.
+                if camera not in pending["retransmitted"]:
+                    rtt = pending["acked"][camera]
+                    stats["rtt"] = rtt if stats["rtt"] is None else 0.875*stats["rtt"] + 0.125*rtt
+            stats["rate"] = stats["acked"]/stats["sent"]
+        missing = sorted(pending["targets"] - set(pending["acked"]))
+        if len(missing) > 0:
+            self.log_message = "Command not acknowledged by: {missing}".format(missing=", ".join(missing))
             self.frontend_log_messages.append(self.log_message)
-            self._check_python_packages(ip_addr)
-            self._install_control_script(ip_addr)
-            self._install_launch_script(ip_addr)
-            self._run_launch_script(ip_addr)
+            log.warning(self.log_message)
+        self.delivered_commands[id] = {"acked": sorted(pending["acked"]), "missing": missing}
+        if len(self.delivered_commands) > 1000:
+            self.delivered_commands.pop(next(iter(self.delivered_commands)))
+        self.ack_condition.notify_all()
+
+    def _listen_on_UDP(self) -> None:
+        # Receive acknowledgements and responses sent back by the cameras.
+        while self.threads_running.is_set():
+            try:
+                data, ip_addr = self.udp_socket.recvfrom(65535)
+                message = json.loads(data)
+            except socket.timeout:
+                continue
+            except Exception as e:
+                log.debug(e)
+                continue
+            received = time.monotonic()
+            try:
+                self._handle_message(message, received)
+            except Exception as e:
+                # A malformed message must never stop the only receive thread.
+                self.log_message = "Failed to handle message from {ip_addr}: {e!r}".format(ip_addr=ip_addr[0], e=e)
+                log.error(self.log_message)
+
+    def _handle_message(self, message: dict, received: float) -> None:
+        # Dispatch an acknowledgement or response received at the given monotonic time.
+        if "ack" in message:
+            with self.ack_condition:
+                for id in message["ack"]:
+                    pending = self.pending_commands.get(id)
+                    if pending is not None and message["hostname"] not in pending["acked"]:
+                        pending["acked"][message["hostname"]] = received - pending["sent"]
+                self.ack_condition.notify_all()
+        elif "clock" in message:
+            sample = message["clock"]
+            with self.ack_condition:
+                t1 = self.clock_requests.pop(sample["id"], None)
+                if t1 is not None:
+                    # Wall clock time the reply arrived.
+                    sample["t1"] = t1
+                    sample["t4"] = time.time() - (time.monotonic() - received)
+                    self.clock_samples.setdefault(sample["hostname"], []).append(sample)
+                    self.ack_condition.notify_all()
+        elif "schedule" in message:
+            report = message["schedule"]
+            if report.get("start") is not None:
+                report["start"] -= self._clock_offset(report["hostname"])
+            with self.ack_condition:
+                self.schedule_reports[report["hostname"]] = report
+                self.ack_condition.notify_all()
+        elif "burst" in message:
+            report = message["burst"]
+            # Report times on the controller clock.
+            for key in ("start", "first", "last"):
+                if report.get(key) is not None:
+                    report[key] -= self._clock_offset(report["hostname"])
+            self.burst_reports[report["hostname"]] = report
+            self.log_message = "Burst {filename} on {hostname} captured {count} images at {fps} fps".format(fps="{:.2f}".format(report["achieved_fps"]) if report["achieved_fps"] else "n/a", **report)
+            self.frontend_log_messages.append(self.log_message)
+            log.info(self.log_message)
+            if report.get("truncated"):
+                self.log_message = "Burst {filename} on {hostname} stopped after {count} of {requested} images as it would not fit in memory".format(**report)
+                self.frontend_log_messages.append(self.log_message)
+                log.warning(self.log_message)
+        else:
+            self.message_buffer.put(message)
+
+    def delivery_report(self) -> dict:
+        with self.ack_condition:
+            return copy.deepcopy(self.delivery)
+
+    def _check_RPi(self, ip_addr: str, restart: bool=False, mac: str=None) -> bool | str:
+        # Set restart if the running agent is out of date even though the installed one may be current. Given
+        # the MAC address, a camera cached with the current agent and required packages is ready once its agent
+        # is running, skipping the manifest.
+        entry = self.cache.get(mac) or {}
+        if not restart and entry.get("agent") == self.agent_name and set(entry.get("packages", {})) >= set(self.required_packages):
+            if self._check_camera_running(ip_addr):
+                self.provisioning_failures.pop(ip_addr, None)
+                return True, ip_addr
+        try:
+            manifest = self._get_remote_manifest(ip_addr)
+            packages = self._check_system_packages(ip_addr, manifest)
+            if manifest["agent"] != self.agent_name:
+                # Raspberry Pi hasn't been used as a camera before or has an old agent.
+                self._install_agent(ip_addr)
+                self._run_launch_script(ip_addr)
+            else:
+                if self._crontab_entry() not in manifest["crontab"]:
+                    self._add_camera_control_script_to_crontab(ip_addr)
+                if restart:
+                    self._run_launch_script(ip_addr)
+        except ProvisioningError as e:
+            # Report the failure for this camera without stopping provisioning of the others.
+            self.provisioning_failures[ip_addr] = str(e)
+            return False, ip_addr
+        self.provisioning_failures.pop(ip_addr, None)
+        self.cache.update(mac, agent=self.agent_name, packages=packages)
         return True, ip_addr
 
     def _set_ssh_credentials(self):
@@ -354,95 +1094,113 @@ class Controller:
     def _recover_image(self, ip_addr: str, filename: str, destination: str) -> None:
         # Recover image from RPi camera.
         try:
-            c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
-            c.get(remote=filename, local=destination)
+            with self._connection(ip_addr) as c:
+                c.get(remote=filename, local=destination)
             log.debug("Image recovered from {ip_addr}".format(ip_addr=ip_addr))
-            c.close()
         except Exception:
-            c.close()
             log.error("Failed to recover image from {ip_addr}".format(ip_addr=ip_addr))
             pass
         
     def _check_hostname(self, ip_addr: str, id: str) -> bool | str | str:
         # Try to connect to the device via SSH. If successful, get the hostname.
         try:
-            c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
-            result = c.run('hostname -s', hide=True)
-            c.close()
+            with self._connection(ip_addr) as c:
+                result = c.run('hostname -s', hide=True)
             hostname = result.stdout.rstrip()
             if id in hostname:
                 return True, hostname, ip_addr
             else:
+                # Not a camera, so don't keep the connection open.
+                self.pool.discard(ip_addr)
                 return False, "none", ip_addr
         except Exception:
-            c.close()
+            self.pool.discard(ip_addr)
             return False, "none", ip_addr
 
-    def _check_camera_control_script(self, ip_addr: str) -> bool:
-        # Check if the camera control script is installed.
-        file_exists_cmd = "test -f /home/{username}/camera.py && echo 'exists' || echo 'does not exist'".format(username=self.username)
-        with open(self.camera_control_script, 'r') as f:
-            camera_control_script_contents = f.read()
-        current_camera_control_script_contents = ""
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
+    def _get_remote_manifest(self, ip_addr: str) -> dict:
+        # Ask the RPi for its installed agent, package versions and crontab in one command.
+        # Raise the real cause if the RPi cannot be reached or its state cannot be read.
+        manifest = {"agent": None, "packages": {}, "crontab": ""}
         try:
-            result = c.run(file_exists_cmd, hide=True)
-            if "exists" in result.stdout:
-                result = c.run('cat /home/{username}/camera.py'.format(username=self.username), hide=True)
-                current_camera_control_script_contents = result.stdout
-        except Exception:
-            self.log_message = "Failed to check if control script is installed on {ip_addr}".format(ip_addr=ip_addr)
+            with self._connection(ip_addr) as c:
+                result = c.run("python3 -c {script}".format(script=shlex.quote(REMOTE_MANIFEST)), hide=True)
+            manifest.update(json.loads(result.stdout))
+        except Exception as e:
+            self.log_message = "Failed to get state of {ip_addr}: {e}".format(ip_addr=ip_addr, e=e)
+            self.frontend_log_messages.append(self.log_message)
             log.warning(self.log_message)
-        
-        # Check if existing camera control script is current.
-        if camera_control_script_contents == current_camera_control_script_contents:
-            return True
-        else:
-            return False
-            
-    def _install_control_script(self, ip_addr: str):
-        # Install the control script on the RPi.
-        destination = '/home/{username}/camera.py'.format(username=self.username)
-        self.log_message = "Installing control script on {ip_addr}".format(ip_addr=ip_addr)
+            raise ProvisioningError(self.log_message) from e
+        return manifest
+
+    def _check_system_packages(self, ip_addr: str, manifest: dict) -> dict:
+        # Compare package names case-insensitively, treating "-" and "_" as equivalent like pip, and
+        # return the installed versions of the required packages.
+        installed = {name.lower().replace("_", "-"): version for name, version in manifest["packages"].items()}
+        versions = {}
+        for package in self.required_packages:
+            versions[package] = installed.get(package.lower().replace("_", "-"))
+            if versions[package] is None:
+                self.log_message = "The {package} package ought to be installed on the RPi by default. This package only works with the RPi.".format(package=package)
+                self.frontend_log_messages.append(self.log_message)
+                log.error(self.log_message)
+                raise ProvisioningError("{package} not installed on {ip_addr}".format(package=package, ip_addr=ip_addr))
+        return versions
+
+    def _crontab_entry(self) -> str:
+        return "@reboot cd /home/{username} && python3 /home/{username}/geocam-agent.pyz\n".format(username=self.username)
+
+    def _install_agent(self, ip_addr: str):
+        # Upload the agent archive in one transfer and point the stable geocam-agent.pyz link at it.
+        filename = agent.build_agent(self.camera_control_script, self.agent_dependencies, self.agent_modules)
+        self.log_message = "Installing camera agent on {ip_addr}".format(ip_addr=ip_addr)
         self.frontend_log_messages.append(self.log_message)
         log.debug(self.log_message)
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
         try:
-            c.put(self.camera_control_script, destination)
-            self.log_message = "Control script installed on {ip_addr}".format(ip_addr=ip_addr)
+            with self._connection(ip_addr) as c:
+                c.put(filename, '/home/{username}/{name}'.format(username=self.username, name=self.agent_name))
+                c.run("cd /home/{username} && ln -sfn {name} geocam-agent.pyz && find . -maxdepth 1 -name 'geocam-agent-*.pyz' ! -name {name} -delete".format(username=self.username, name=self.agent_name), hide=True)
+            self.log_message = "Camera agent installed on {ip_addr}".format(ip_addr=ip_addr)
             log.info(self.log_message)
-        except Exception:
-            self.log_message = "Failed to install control script on {ip_addr}".format(ip_addr=ip_addr)
+        except Exception as e:
+            self.log_message = "Failed to install camera agent on {ip_addr}".format(ip_addr=ip_addr)
             log.warning(self.log_message)
-        c.close()
+            raise ProvisioningError(self.log_message) from e
         self._add_camera_control_script_to_crontab(ip_addr)
-    
-    def _install_launch_script(self, ip_addr: str):
-        # Install the launch script on the RPi.
-        destination = '/home/{username}/launch.py'.format(username=self.username)
-        self.log_message = "Installing launch script on {ip_addr}".format(ip_addr=ip_addr)
+
+    def _install_camera_configuration(self, ip_addr: str, configuration: dict):
+        # Merge the settings into the camera startup configuration on the RPi, keeping any other settings.
+        destination = '/home/{username}/camera.json'.format(username=self.username)
+        self.log_message = "Installing camera configuration on {ip_addr}".format(ip_addr=ip_addr)
         self.frontend_log_messages.append(self.log_message)
         log.debug(self.log_message)
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
         try:
-            c.put(self.launch_script, destination)
-            self.log_message = "Launch script installed on {ip_addr}".format(ip_addr=ip_addr)
+            with self._connection(ip_addr) as c:
+                merged = {}
+                result = c.run("cat {destination}".format(destination=destination), hide=True, warn=True)
+                if result.ok:
+                    try:
+                        merged = json.loads(result.stdout)
+                    except ValueError:
+                        self.log_message = "Replacing unreadable camera configuration on {ip_addr}".format(ip_addr=ip_addr)
+                        log.warning(self.log_message)
+                merged.update(configuration)
+                c.put(io.BytesIO(json.dumps(merged, indent=4).encode()), destination)
+            self.log_message = "Camera configuration installed on {ip_addr}".format(ip_addr=ip_addr)
             log.info(self.log_message)
         except Exception:
-            self.log_message = "Failed to install launch script on {ip_addr}".format(ip_addr=ip_addr)
+            self.log_message = "Failed to install camera configuration on {ip_addr}".format(ip_addr=ip_addr)
             log.warning(self.log_message)
-        c.close()
 
     def _run_launch_script(self, ip_addr: str):
-        # Run the launch script on the RPi.
-        self.log_message = "Running launch script on {ip_addr}".format(ip_addr=ip_addr)
+        # Run the camera agent on the RPi.
+        self.log_message = "Running camera agent on {ip_addr}".format(ip_addr=ip_addr)
         self.frontend_log_messages.append(self.log_message)
         log.debug(self.log_message)
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
         
-        # Kill any existing camera.py processes.
+        # Kill any existing agent or legacy camera.py processes.
         try:
-            c.run('pkill -f camera.py -9', hide=True, warn=True)
+            with self._connection(ip_addr) as c:
+                c.run("pkill -9 -f '[c]amera.py|[g]eocam-agent'", hide=True, warn=True)
             self.log_message = "Killed existing camera.py processes on {ip_addr}".format(ip_addr=ip_addr)
             log.debug(self.log_message)
         except Exception as e:
@@ -451,20 +1209,20 @@ class Controller:
             log.warning(self.log_message)
             log.warning(e)
         
-        # Run the launch script (ignoring any exceptions raised by Fabric).
+        # Start the agent detached from the session (ignoring any exceptions raised by Fabric).
         try:
-            c.run('python3 /home/{username}/launch.py &'.format(username=self.username), hide=True, timeout=2, warn=True)
-            self.log_message = "Launch script run on {ip_addr}".format(ip_addr=ip_addr)
+            with self._connection(ip_addr) as c:
+                c.run('cd /home/{username} && nohup python3 geocam-agent.pyz > /dev/null 2>&1 &'.format(username=self.username), hide=True, timeout=2, warn=True)
+            self.log_message = "Camera agent started on {ip_addr}".format(ip_addr=ip_addr)
             log.info(self.log_message)
         except Exception:
             pass
-        c.close()
 
     def _check_camera_running(self, ip_addr: str) -> bool:
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
         try:
-            result = c.run('ps aux | grep "[c]amera.py"', hide=True)
-            if "camera.py" in result.stdout:
+            with self._connection(ip_addr) as c:
+                result = c.run('ps aux | grep -E "[c]amera.py|[g]eocam-agent"', hide=True)
+            if result.stdout.strip():
                 self.log_message = "Camera is running on {ip_addr}".format(ip_addr=ip_addr)
                 self.frontend_log_messages.append(self.log_message)
                 log.info(self.log_message)
@@ -475,201 +1233,45 @@ class Controller:
             log.warning(self.log_message)
             return False
 
-    def _check_python_packages(self, ip_addr: str):
-        # Get list of installed Python packages.
-        self.log_message = "Checking Python packages on {ip_addr}".format(ip_addr=ip_addr)
-        self.frontend_log_messages.append(self.log_message)
-        log.info(self.log_message)
-        pip_list = self._get_python_package_list(ip_addr)
-        for package in self.required_packages:
-            if package not in pip_list:
-                if package == 'picamera2':
-                    self.log_message = "The picamera2 package ought to be installed on the RPi by default. This package only works with the RPi."
+    def _add_camera_control_script_to_crontab(self, ip_addr: str):
+        # Add the agent to the crontab if not already added, replacing any entry for an older agent or camera.py.
+        crontab_cmd = self._crontab_entry()
+        try:
+            with self._connection(ip_addr) as c:
+                result = c.run("crontab -l", hide=True, warn=True)
+                if crontab_cmd in result.stdout:
+                    self.log_message = "Control script already set to autostart on {ip_addr}".format(ip_addr=ip_addr)
                     self.frontend_log_messages.append(self.log_message)
-                    log.error(self.log_message)
+                    log.info(self.log_message)
                 else:
-                    self.log_message = "Python package {package} not installed on {ip_addr}".format(package=package, ip_addr=ip_addr)
+                    self.log_message = "Adding control script to the crontab on {ip_addr}".format(ip_addr=ip_addr)
                     self.frontend_log_messages.append(self.log_message)
-                    log.warning(self.log_message)
-                    self._install_python_package(ip_addr, package)
-
-    def _get_python_package_list(self, ip_addr: str) -> str:
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
-        # Check if pip.pyz is installed on the RPi.
-        pip_exists_cmd = "test -f /home/{username}/pip.pyz && echo 'exists' || echo 'does not exist'".format(username=self.username)
-        try: 
-            result = c.run(pip_exists_cmd, hide=True)
-            if "exists" not in result.stdout:
-                self._install_python_dependencies(ip_addr)
-                self._install_python_package_manager(ip_addr)
-        except Exception:
-            self.log_message = "Failed to check if pip.pyz installed on {ip_addr}".format(ip_addr=ip_addr)
-            log.error(self.log_message)
-            sys.exit(1)
-
-        pip_list = ""
-        try:
-            result = c.run('python3 pip.pyz list', hide=True)
-            c.close()
-            pip_list = result.stdout
-            return pip_list
-        except Exception:
-            self.log_message = "Could not get list of installed packages."
-            log.error(self.log_message)
-            sys.exit(1)
-
-    def _install_python_dependencies(self, ip_addr: str)  -> bool:
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
-        # Upload package to RPi.
-        try:
-            c.put(self.lib2to3_file, '/home/{username}/{lib2to3}'.format(username=self.username, lib2to3=self.lib2to3_name))
-            c.put(self.distutils_file, '/home/{username}/{distutils}'.format(username=self.username, distutils=self.distutils_name))
-            self.log_message = "Uploaded Python dependencies to {ip_addr}".format(ip_addr=ip_addr)
-            log.info(self.log_message)
-        except Exception:
-            self.log_message = "Failed to upload Python dependencies to {ip_addr}".format(ip_addr=ip_addr)
-            log.error(self.log_message)
-            sys.exit(1)
-
-        # Install package on RPi.
-        try:
-            self.log_message = "Installing Python dependencies on {ip_addr}".format(ip_addr=ip_addr)
-            log.debug(self.log_message)
-            c.sudo('dpkg -i {lib2to3}'.format(lib2to3=self.lib2to3_name), hide=True)
-            c.sudo('dpkg -i {distutils}'.format(distutils=self.distutils_name), hide=True)
-            c.sudo('rm *.deb', hide=True)
-            self.log_message = "Python dependencies installed on {ip_addr}".format(ip_addr=ip_addr)
-            log.info(self.log_message)
-        except Exception:
-            self.log_message = "Failed to install Python dependencies on {ip_addr}".format(ip_addr=ip_addr)
-            log.error(self.log_message)
-            sys.exit(1)
-
-        # Close connection and remove downloaded package.
-        c.close()
-        return True
-
-    def _install_python_package_manager(self, ip_addr: str)  -> bool:
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
-        self.log_message = "Installing Python package manager on {ip_addr}".format(ip_addr=ip_addr)
-        log.info(self.log_message)
-        success = False
-        try:
-            c.put(self.pip_pyz, '/home/{username}/pip.pyz'.format(username=self.username))
-            success = True
-            self.log_message = "Installed pip.pyz on {ip_addr}".format(ip_addr=ip_addr)
-            log.info(self.log_message)
-        except Exception:
-            self.log_message = "Failed to install pip.pyz on {ip_addr}".format(ip_addr=ip_addr)
-            log.error(self.log_message)
-            sys.exit(1)
-        return success
-        
-    def _install_python_package(self, ip_addr: str, package: str) -> bool:
-        # Select package.
-        if package == "getmac":
-            wheel = self.getmac_wheel
-            wheel_name = self.getmac_wheel_name
-        elif package == "blinker":
-            wheel = self.blinker_wheel
-            wheel_name = self.blinker_wheel_name
-        elif package == "click":
-            wheel = self.click_wheel
-            wheel_name = self.click_wheel_name
-        elif package == "itsdangerous":
-            wheel = self.itsdangerous_wheel
-            wheel_name = self.itsdangerous_wheel_name
-        elif package == "Jinja2":
-            wheel = self.Jinja2_wheel
-            wheel_name = self.Jinja2_wheel_name
-        elif package == "Werkzeug":
-            wheel = self.Werkzeug_wheel
-            wheel_name = self.Werkzeug_wheel_name
-        elif package == "MarkupSafe":
-            wheel = self.MarkupSafe_wheel
-            wheel_name = self.MarkupSafe_wheel_name
-        elif package == "Flask":
-            wheel = self.Flask_wheel
-            wheel_name = self.Flask_wheel_name
-        elif package == "Flask-Cors":
-            wheel = self.Flask_Cors_wheel
-            wheel_name = self.Flask_Cors_wheel_name
-
-        c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
-        # Upload package to RPi.
-        try:
-            c.put(wheel, '/home/{username}/{wheel}'.format(username=self.username, wheel=wheel_name))
-            self.log_message = "Uploaded {package} to {ip_addr}".format(package=package, ip_addr=ip_addr)
-            self.frontend_log_messages.append(self.log_message)
-            log.info(self.log_message)
-        except Exception:
-            self.log_message = "Failed to upload {package} to {ip_addr}".format(package=package, ip_addr=ip_addr)
-            self.frontend_log_messages.append(self.log_message)
-            log.error(self.log_message)
-            sys.exit(1)
-
-        # Install package on RPi.
-        try:
-            self.log_message = "Installing Python package {package} on {ip_addr}".format(package=package, ip_addr=ip_addr)
-            self.frontend_log_messages.append(self.log_message)
-            log.debug(self.log_message)
-            c.sudo('python3 pip.pyz install {wheel}'.format(wheel=wheel_name), hide=True)
-            c.sudo('rm {wheel}'.format(wheel=wheel_name), hide=True)
-            self.log_message = "Python package {package} installed on {ip_addr}".format(package=package, ip_addr=ip_addr)
-            self.frontend_log_messages.append(self.log_message)
-            log.info(self.log_message)
-        except Exception:
-            self.log_message = "Failed to install Python package {package} on {ip_addr}".format(package=package, ip_addr=ip_addr)
-            self.frontend_log_messages.append(self.log_message)
-            log.error(self.log_message)
-            sys.exit(1)
-
-        # Close connection and remove downloaded package.
-        c.close()
-        return True
-
-    def _add_camera_control_script_to_crontab(self, ip_addr: str):
-        # Add the control script to the crontab if not already added.
-        crontab_cmd = "@reboot python3 /home/{username}/camera.py\n".format(username=self.username)
-        crontab = open("crontab", "a")
-        crontab.write(crontab_cmd)
-        crontab.close()
-        try:
-            c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
-            result = c.run("crontab -l", hide=True, warn=True)
-            if crontab_cmd in result.stdout:
-                self.log_message = "Control script already set to autostart on {ip_addr}".format(ip_addr=ip_addr)
-                self.frontend_log_messages.append(self.log_message)
-                log.info(self.log_message)
-            else:
-                self.log_message = "Adding control script to the crontab on {ip_addr}".format(ip_addr=ip_addr)
-                self.frontend_log_messages.append(self.log_message)
-                log.info(self.log_message)
-                c.put('crontab', '/home/{username}/crontab'.format(username=self.username))
-                self.log_message = "Uploaded crontab script to {ip_addr}".format(ip_addr=ip_addr)
-                self.frontend_log_messages.append(self.log_message)
-                log.info(self.log_message)
-                c.run('crontab /home/{username}/crontab'.format(username=self.username), hide=True)
-                c.sudo('rm crontab', hide=True)
-                self.log_message = "Control script added to the crontab on {ip_addr}".format(ip_addr=ip_addr)
-                self.frontend_log_messages.append(self.log_message)
-                log.info(self.log_message)
+                    log.info(self.log_message)
+                    c.run("(crontab -l 2>/dev/null | grep -v -E 'camera.py|geocam-agent'; printf %s {entry}) | crontab -".format(entry=shlex.quote(crontab_cmd)), hide=True)
+                    self.log_message = "Control script added to the crontab on {ip_addr}".format(ip_addr=ip_addr)
+                    self.frontend_log_messages.append(self.log_message)
+                    log.info(self.log_message)
         except Exception as e:   
             log.error(e)
             self.log_message = "Failed to add control script to the crontab on {ip_addr}".format(ip_addr=ip_addr)
             log.error(self.log_message)
-            sys.exit(1)
-        os.system("rm crontab")
+            raise ProvisioningError(self.log_message) from e
 
     def _reboot_camera(self, ip_addr: str):
         log.info("Rebooting {ip_addr}".format(ip_addr=ip_addr))
         try:
-            c = Connection(host=ip_addr, user=self.username, connect_kwargs={"password": self.password})
-            c.sudo('reboot', hide=True)
-            c.close()
+            with self._connection(ip_addr) as c:
+                c.sudo('reboot', hide=True)
         except Exception:
             self.log_message = "Failed to reboot {ip_addr}".format(ip_addr=ip_addr)
             log.warning(self.log_message)
+        # The connection will not survive the reboot.
+        self.pool.discard(ip_addr)
+
+    def _connection(self, ip_addr: str):
+        # All remote operations share pooled connections opened with the current credentials.
+        self.pool.set_credentials(self.username, self.password)
+        return self.pool.connection(ip_addr)
 
     def _get_ip(self) -> str:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -1,4 +0,0 @@
-import os
-
-if __name__ == "__main__":
-    os.system("python3 camera.py &")
\ No newline at end of file
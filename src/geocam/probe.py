@@ -0,0 +1,130 @@
+"""
+
+Subnet probe module for geocam.
+
+"""
+import asyncio
+import ipaddress
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class SubnetProbe:
+    def __init__(self, ports: tuple=(22, 8002), concurrency: int=256, timeout: float=0.5, rate: float=2000.0):
+        """
+
+        Asynchronous TCP connect probe used to find candidate cameras on one or
+        more networks of any size.
+
+        Parameters
+        ----------
+        ports : tuple
+            TCP ports to probe on each host. Defaults to SSH (22) and the camera HTTP port (8002).
+        concurrency : int
+            Maximum number of connection attempts in flight. Defaults to 256.
+        timeout : float
+            Timeout in seconds for each connection attempt. Defaults to 0.5.
+        rate : float
+            Maximum number of connection attempts started per second, or None
+            for no limit. Defaults to 2000.0.
+
+        """
+        self.ports = tuple(ports)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.rate = rate
+        self.stats = {}
+
+    def run(self, networks) -> dict:
+        """
+
+        Probe every host address in the networks.
+
+        Parameters
+        ----------
+        networks : str, ipaddress.IPv4Network or list
+            Network in CIDR notation or a list of networks.
+
+        Returns
+        -------
+        dict
+            Open ports keyed by the IP address of each host with at least one open port.
+
+        """
+        hosts = self.hosts(networks)
+        start_time = time.monotonic()
+        found = asyncio.run(self._probe_all(hosts))
+        elapsed = time.monotonic() - start_time
+        self.stats = {
+            "hosts": len(hosts),
+            "probes": len(hosts)*len(self.ports),
+            "found": len(found),
+            "elapsed": elapsed,
+        }
+        log.debug("Probed {hosts} hosts in {elapsed:.2f} s".format(hosts=len(hosts), elapsed=elapsed))
+        return found
+
+    @staticmethod
+    def hosts(networks) -> list:
+        """
+
+        Expand one or more networks into a list of unique host addresses.
+
+        Parameters
+        ----------
+        networks : str, ipaddress.IPv4Network or list
+            Network in CIDR notation or a list of networks.
+
+        Returns
+        -------
+        list
+            Host IP addresses in order.
+
+        """
+        if isinstance(networks, (str, ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            networks = [networks]
+        hosts = {}
+        for network in networks:
+            network = ipaddress.ip_network(network, strict=False)
+            addresses = network.hosts() if network.num_addresses > 2 else iter(network)
+            for address in addresses:
+                hosts[str(address)] = None
+        return list(hosts)
+
+    async def _probe_all(self, hosts: list) -> dict:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        throttle = {"lock": asyncio.Lock(), "next": time.monotonic()}
+        probes = [(ip, port) for ip in hosts for port in self.ports]
+        results = await asyncio.gather(*(self._probe(ip, port, semaphore, throttle) for ip, port in probes))
+        found = {}
+        for (ip, port), is_open in zip(probes, results):
+            if is_open:
+                found.setdefault(ip, []).append(port)
+        return found
+
+    async def _probe(self, ip: str, port: int, semaphore: asyncio.Semaphore, throttle: dict) -> bool:
+        async with semaphore:
+            await self._throttle(throttle)
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                return False
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            return True
+
+    async def _throttle(self, throttle: dict) -> None:
+        # Space out connection attempts to stay within the rate limit.
+        if not self.rate:
+            return
+        async with throttle["lock"]:
+            now = time.monotonic()
+            start = max(now, throttle["next"])
+            throttle["next"] = start + 1.0/self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
@@ -0,0 +1,250 @@
+"""
+
+Wire format module for geocam.
+
+Commands are sent to the cameras as a versioned envelope holding a batch of
+one or more commands. Each datagram starts with a fixed header:
+
+    magic (2 bytes) | version (1) | flags (1) | message id (4) | fragment index (2) | fragment count (2)
+
+followed by a fragment of the compact JSON envelope, which is compressed
+with zlib when that makes it smaller. Envelopes larger than a single
+datagram are split into fragments that are reassembled by the camera.
+
+"""
+from __future__ import annotations  # Also imported by the camera agent, which may run on Python 3.9.
+import json
+import struct
+import time
+import zlib
+
+MAGIC = b"GC"
+VERSION = 1
+HEADER = struct.Struct("!2sBBIHH")
+FLAG_COMPRESSED = 0x01
+MAX_DATAGRAM = 1400  # Keep datagrams within a typical Ethernet MTU.
+MAX_FRAGMENT = MAX_DATAGRAM - HEADER.size
+COMPRESS_THRESHOLD = 512  # Smaller payloads are not worth the cost of compressing.
+SERIES_DIGITS = 5  # Zero padding of frame numbers, so images sort by name.
+
+
+def encode(envelope: dict, message_id: int) -> list:
+    """
+
+    Encode an envelope of commands as one or more datagrams.
+
+    Parameters
+    ----------
+    envelope : dict
+        Envelope with the id, seq and list of commands to send.
+    message_id : int
+        Identifier used to reassemble fragments.
+
+    Returns
+    -------
+    list
+        Datagrams to send, in order.
+
+    """
+    payload = json.dumps(envelope, separators=(",", ":")).encode()
+    flags = 0
+    if len(payload) > COMPRESS_THRESHOLD:
+        compressed = zlib.compress(payload)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_COMPRESSED
+    fragments = [payload[i:i+MAX_FRAGMENT] for i in range(0, len(payload), MAX_FRAGMENT)] or [b""]
+    if len(fragments) > 0xFFFF:
+        raise ValueError("Envelope too large to fragment.")
+    message_id &= 0xFFFFFFFF
+    return [HEADER.pack(MAGIC, VERSION, flags, message_id, index, len(fragments)) + fragment for index, fragment in enumerate(fragments)]
+
+
+def series_name(name: str, n: int) -> str:
+    """
+
+    Name a frame in a capture series, burst or time-lapse. Shared by the
+    controller and the cameras so that every series is named alike.
+
+    Parameters
+    ----------
+    name : str
+        Name of the series.
+    n : int
+        Frame number, starting at 1.
+
+    Returns
+    -------
+    str
+        File name without extension.
+
+    """
+    return "{name}_{n:0{digits}d}".format(name=name, n=n, digits=SERIES_DIGITS)
+
+
+def decode(payload: bytes, flags: int) -> dict:
+    """
+
+    Decode a reassembled envelope.
+
+    Parameters
+    ----------
+    payload : bytes
+        Reassembled envelope payload.
+    flags : int
+        Header flags of the message.
+
+    Returns
+    -------
+    dict
+        Envelope with the id, seq and list of commands.
+
+    """
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    return json.loads(payload)
+
+
+class Reassembler:
+    def __init__(self, timeout: float=2.0):
+        """
+
+        Reassembles fragmented envelopes received from one or more senders.
+        Datagrams in the original uncompressed JSON format are accepted as
+        single-command envelopes.
+
+        Parameters
+        ----------
+        timeout : float
+            Time in seconds after which incomplete messages are discarded. Defaults to 2.0.
+
+        """
+        self.timeout = timeout
+        self.messages = {}
+
+    def add(self, datagram: bytes, sender) -> dict | None:
+        """
+
+        Add a received datagram.
+
+        Parameters
+        ----------
+        datagram : bytes
+            Received datagram.
+        sender : tuple
+            Address of the sender.
+
+        Returns
+        -------
+        dict or None
+            The envelope once all of its fragments have arrived, otherwise None.
+
+        Raises
+        ------
+        ValueError
+            If the datagram is not in a recognised format.
+
+        """
+        if datagram[:1] == b"{":
+            # Original format: a single JSON command per datagram.
+            command = json.loads(datagram)
+            return {"id": command.get("id"), "seq": command.get("seq"), "commands": [command]}
+        if len(datagram) < HEADER.size:
+            raise ValueError("Datagram too short.")
+        magic, version, flags, message_id, index, count = HEADER.unpack_from(datagram)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unsupported datagram format.")
+        fragment = datagram[HEADER.size:]
+        if count == 1:
+            return decode(fragment, flags)
+
+        # Collect fragments until the message is complete.
+        now = time.monotonic()
+        for key in [key for key, message in self.messages.items() if now - message["time"] > self.timeout]:
+            del self.messages[key]
+        key = (sender, message_id)
+        message = self.messages.setdefault(key, {"time": now, "count": count, "fragments": {}})
+        message["fragments"][index] = fragment
+        if len(message["fragments"]) < message["count"]:
+            return None
+        del self.messages[key]
+        payload = b"".join(message["fragments"][i] for i in range(message["count"]))
+        return decode(payload, flags)
+
+
+def benchmark(repeat: int=10000) -> dict:
+    """
+
+    Compare the encode/decode cost, datagram count and bytes sent by this
+    format against the original one-command-per-datagram JSON format.
+
+    Parameters
+    ----------
+    repeat : int
+        Number of repetitions for timing. Defaults to 10000.
+
+    Returns
+    -------
+    dict
+        Results for each scenario and format.
+
+    """
+    capture = {"command": "captureFrame", "args": {"filename": "IMG_01", "format": "jpg", "time": time.time()}}
+    controls = {"command": "updateControls", "args": {"ExposureTime": 20000, "AnalogueGain": 1.0, "AwbEnable": False}}
+    schedule = {"command": "startSchedule", "args": {"frames": [{"filename": "IMG_{n:04d}".format(n=n), "time": time.time() + 10*n} for n in range(200)]}}
+    scenarios = {
+        "capture": [capture],
+        "controls+capture": [controls, capture],
+        "large": [schedule],
+    }
+    results = {}
+    for name, commands in scenarios.items():
+        # Original format: one indented JSON datagram per command.
+        tagged = [dict(command, id="benchmark", seq=1) for command in commands]
+        legacy = [json.dumps(command, indent=2).encode() for command in tagged]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            [json.dumps(command, indent=2).encode() for command in tagged]
+        legacy_encode = (time.perf_counter() - start)/repeat
+        start = time.perf_counter()
+        for _ in range(repeat):
+            [json.loads(datagram) for datagram in legacy]
+        legacy_decode = (time.perf_counter() - start)/repeat
+
+        # Batched format.
+        envelope = {"id": "benchmark", "seq": 1, "commands": commands}
+        datagrams = encode(envelope, 1)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            encode(envelope, 1)
+        batched_encode = (time.perf_counter() - start)/repeat
+        reassembler = Reassembler()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for datagram in datagrams:
+                reassembler.add(datagram, ("127.0.0.1", 0))
+        batched_decode = (time.perf_counter() - start)/repeat
+
+        results[name] = {
+            "legacy": {
+                "datagrams": len(legacy),
+                "bytes": sum(len(datagram) for datagram in legacy),
+                "max_datagram": max(len(datagram) for datagram in legacy),
+                "encode_us": legacy_encode*1e6,
+                "decode_us": legacy_decode*1e6,
+            },
+            "batched": {
+                "datagrams": len(datagrams),
+                "bytes": sum(len(datagram) for datagram in datagrams),
+                "max_datagram": max(len(datagram) for datagram in datagrams),
+                "encode_us": batched_encode*1e6,
+                "decode_us": batched_decode*1e6,
+            },
+        }
+    return results
+
+
+if __name__ == "__main__":
+    for name, result in benchmark().items():
+        for fmt, r in result.items():
+            print("{name:<18} {fmt:<8} datagrams={datagrams:<3} bytes={bytes:<6} max={max_datagram:<6} encode={encode_us:8.2f} us decode={decode_us:8.2f} us".format(name=name, fmt=fmt, **r))
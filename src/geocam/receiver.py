@@ -0,0 +1,199 @@
+"""
+
+Image receiver module for geocam.
+
+Cameras streaming images connect to the controller over TCP and send each
+image as a frame:
+
+    header length (4 bytes) | payload length (4 bytes) | JSON header | image
+
+The JSON header holds the hostname, filename and capture time. Once the
+image has been written to disk the receiver replies with a frame whose
+header is {"ack": filename}, and the camera then sends the next image.
+
+"""
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+FRAME = struct.Struct("!II")
+MAX_HEADER = 64*1024
+
+
+class ImageReceiver:
+    def __init__(self, port: int, directory: str="images", on_image=None, clock=None):
+        """
+
+        TCP server that receives images pushed by cameras during capture.
+
+        Parameters
+        ----------
+        port : int
+            TCP port to listen on.
+        directory : str
+            Directory in which images are stored in a folder per camera. Defaults to "images".
+        on_image : callable, optional
+            Called with the camera hostname, filename and path of each image received.
+        clock : callable, optional
+            Called with the camera hostname to get the offset of its clock from
+            the controller clock, used to correct capture times.
+
+        """
+        self.port = port
+        self.directory = directory
+        self.on_image = on_image
+        self.clock = clock
+        self.running = threading.Event()
+        self._socket = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"connections": 0, "received": 0, "failed": 0, "bytes": 0, "latency": 0.0, "max_latency": 0.0, "cameras": {}}
+
+    def start(self) -> None:
+        """
+
+        Start listening for cameras in a background thread, if not already started.
+
+        """
+        with self._lock:
+            if self.running.is_set():
+                return
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind(('', self.port))
+            server.listen()
+            server.settimeout(0.5)
+            self._socket = server
+            self.running.set()
+            self._thread = threading.Thread(target=self._serve, daemon=True)
+            self._thread.start()
+        log.debug("Listening for images on port {port}".format(port=self.port))
+
+    def stop(self) -> None:
+        """
+
+        Stop accepting connections.
+
+        """
+        self.running.clear()
+        if self._thread is not None:
+            self._thread.join()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def stats(self) -> dict:
+        """
+
+        Return the receiver counters.
+
+        Returns
+        -------
+        dict
+            Images and bytes received, failures and the mean and maximum time from
+            capture to receipt, overall and per camera.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cameras"] = {camera: dict(counters) for camera, counters in self._stats["cameras"].items()}
+        return stats
+
+    def _serve(self) -> None:
+        while self.running.is_set():
+            try:
+                conn, addr = self._socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self._count("connections")
+            threading.Thread(target=self._handle, args=(conn, addr), daemon=True).start()
+
+    def _handle(self, conn: socket.socket, addr: tuple) -> None:
+        # Receive images until the camera disconnects, acknowledging each one once it is on disk.
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn:
+            while self.running.is_set():
+                try:
+                    header, payload = self._receive(conn)
+                except (OSError, ValueError):
+                    break
+                if header is None:
+                    break
+                try:
+                    path = self._store(header, payload)
+                except (OSError, KeyError) as e:
+                    log.error("Failed to store image from {ip}: {e}".format(ip=addr[0], e=e))
+                    self._count("failed")
+                    reply = {"nack": header.get("filename")}
+                else:
+                    self._record(header, len(payload))
+                    reply = {"ack": header["filename"]}
+                    if self.on_image is not None:
+                        self.on_image(header["hostname"], header["filename"], path)
+                try:
+                    data = json.dumps(reply).encode()
+                    conn.sendall(FRAME.pack(len(data), 0) + data)
+                except OSError:
+                    break
+
+    def _receive(self, conn: socket.socket) -> tuple:
+        prefix = self._receive_exactly(conn, FRAME.size)
+        if prefix is None:
+            return None, None
+        header_length, payload_length = FRAME.unpack(prefix)
+        if header_length > MAX_HEADER:
+            raise ValueError("Header too large.")
+        header = json.loads(self._receive_exactly(conn, header_length) or b"")
+        payload = self._receive_exactly(conn, payload_length) if payload_length > 0 else b""
+        if payload is None:
+            raise ValueError("Connection closed mid-image.")
+        return header, payload
+
+    def _receive_exactly(self, conn: socket.socket, n: int) -> bytes | None:
+        buffer = bytearray(n)
+        view = memoryview(buffer)
+        received = 0
+        while received < n:
+            count = conn.recv_into(view[received:])
+            if count == 0:
+                return None
+            received += count
+        return bytes(buffer)
+
+    def _store(self, header: dict, payload: bytes) -> str:
+        # Write atomically so a partial image is never mistaken for a recovered one.
+        directory = os.path.join(self.directory, os.path.basename(header["hostname"]))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, os.path.basename(header["filename"]))
+        partial = path + ".part"
+        with open(partial, "wb") as f:
+            f.write(payload)
+        os.replace(partial, path)
+        return path
+
+    def _record(self, header: dict, size: int) -> None:
+        offset = self.clock(header["hostname"]) if self.clock is not None else 0.0
+        latency = time.time() - (header["time"] - offset) if header.get("time") else 0.0
+        with self._lock:
+            stats = self._stats
+            stats["received"] += 1
+            stats["bytes"] += size
+            stats["latency"] += (latency - stats["latency"])/stats["received"]
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            camera = stats["cameras"].setdefault(header["hostname"], {"received": 0, "bytes": 0, "last": None, "last_time": None})
+            camera["received"] += 1
+            camera["bytes"] += size
+            camera["last"] = header["filename"]
+            camera["last_time"] = header["time"] - offset if header.get("time") else None  # Capture time on the controller clock.
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
@@ -0,0 +1,146 @@
+"""
+
+Capture scheduler module for geocam.
+
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class CaptureScheduler:
+    def __init__(self, trigger, number: int, interval: float, tolerance: float=None, on_complete=None):
+        """
+
+        Background scheduler that fires a trigger at absolute monotonic
+        deadlines start + n*interval, so that timing errors never accumulate
+        over a series.
+
+        Parameters
+        ----------
+        trigger : callable
+            Called with the frame number (starting at 1) at each deadline.
+        number : int
+            Number of triggers in the series.
+        interval : float
+            Interval in seconds between triggers. An interval of zero or less
+            fires the triggers back to back, each as soon as the previous one
+            returns, without checking for missed deadlines.
+        tolerance : float, optional
+            Maximum lateness in seconds before a deadline is flagged as missed
+            and skipped rather than fired late. Defaults to half the interval,
+            or 50 ms for short intervals.
+        on_complete : callable, optional
+            Called with the report once the series has finished.
+
+        """
+        self.trigger = trigger
+        self.number = number
+        self.interval = interval
+        self.tolerance = tolerance if tolerance is not None else max(0.5*interval, 0.05)
+        self.on_complete = on_complete
+        self.frames = []
+        self.start_time = None
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        """
+
+        Start the series in a background thread.
+
+        """
+        self._thread.start()
+
+    def cancel(self) -> None:
+        """
+
+        Cancel any triggers that have not yet fired.
+
+        """
+        self._cancelled.set()
+
+    def wait(self, timeout: float=None) -> bool:
+        """
+
+        Block until the series has finished.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time in seconds to wait.
+
+        Returns
+        -------
+        bool
+            True if the series has finished.
+
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def report(self) -> dict:
+        """
+
+        Return the timing report for the frames scheduled so far.
+
+        Returns
+        -------
+        dict
+            Per-frame deadlines, jitter and missed flags with summary statistics.
+
+        """
+        frames = list(self.frames)
+        jitter = [frame["jitter"] for frame in frames if not frame["missed"]]
+        return {
+            "number": self.number,
+            "interval": self.interval,
+            "running": self.running,
+            "cancelled": self._cancelled.is_set(),
+            "fired": len(jitter),
+            "missed": sum(1 for frame in frames if frame["missed"]),
+            "mean_jitter": sum(jitter)/len(jitter) if len(jitter) > 0 else 0.0,
+            "max_jitter": max(jitter, default=0.0),
+            "frames": frames,
+        }
+
+    def _run(self) -> None:
+        self.start_time = time.monotonic()
+        back_to_back = self.interval <= 0
+        for n in range(self.number):
+            if back_to_back:
+                # Each trigger is due as soon as the previous one has returned.
+                deadline = time.monotonic()
+            else:
+                deadline = self.start_time + n*self.interval
+            if self._sleep_until(deadline):
+                break
+            lateness = time.monotonic() - deadline
+            frame = {"n": n+1, "deadline": deadline - self.start_time, "jitter": lateness, "missed": not back_to_back and lateness > self.tolerance}
+            if frame["missed"]:
+                # Keep the series on its original time base rather than firing late.
+                log.warning("Missed deadline for frame {n} by {lateness:.3f} s".format(n=n+1, lateness=lateness))
+            else:
+                try:
+                    self.trigger(n+1)
+                except Exception as e:
+                    frame["missed"] = True
+                    log.error("Trigger for frame {n} failed: {e}".format(n=n+1, e=e))
+            self.frames.append(frame)
+        if self.on_complete is not None:
+            self.on_complete(self.report())
+
+    def _sleep_until(self, deadline: float) -> bool:
+        # Sleep coarsely until shortly before the deadline, then yield until it passes.
+        remaining = deadline - time.monotonic()
+        if remaining > 0.002 and self._cancelled.wait(remaining - 0.002):
+            return True
+        while time.monotonic() < deadline:
+            time.sleep(0)
+        return self._cancelled.is_set()
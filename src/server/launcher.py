@@ -2,6 +2,7 @@ from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
 import webbrowser
 import geocam as gc
+import json
 import logging
 from threading import Timer
 import os
@@ -44,26 +45,120 @@ def captureImages():
     number = data['number']
     interval = data['interval']
     recover = data['recover']
-    success = controller.capture_images(name, number, interval, recover)
+    stream = data.get('stream', False)
+    success = controller.capture_images(name, number, interval, recover, stream=stream)
     response = {"success": success}
     return jsonify(response)
 
+@app.route('/captureBurst', methods=['POST'])
+def captureBurst():
+    data = request.json
+    name = data['name']
+    count = data['count']
+    rate = data.get('rate')
+    stream = data.get('stream', False)
+    controller.capture_burst(name, count, rate, stream=stream)
+    response = {"success": True}
+    return jsonify(response)
+
+@app.route('/burstStatus', methods=['GET'])
+def burstStatus():
+    if request.method == 'GET':
+        report = controller.burst_status()
+        return jsonify(report)
+
+@app.route('/startSchedule', methods=['POST'])
+def startSchedule():
+    data = request.json
+    name = data['name']
+    interval = data['interval']
+    count = data['count']
+    stream = data.get('stream', False)
+    controller.start_schedule(name, interval, count, stream=stream)
+    response = {"success": True}
+    return jsonify(response)
+
+@app.route('/pauseSchedule', methods=['POST'])
+def pauseSchedule():
+    controller.pause_schedule()
+    return jsonify({"success": True})
+
+@app.route('/resumeSchedule', methods=['POST'])
+def resumeSchedule():
+    controller.resume_schedule()
+    return jsonify({"success": True})
+
+@app.route('/cancelSchedule', methods=['POST'])
+def cancelSchedule():
+    controller.cancel_schedule()
+    return jsonify({"success": True})
+
+@app.route('/scheduleStatus', methods=['GET'])
+def scheduleStatus():
+    if request.method == 'GET':
+        report = controller.schedule_status()
+        return jsonify(report)
+
+@app.route('/syncClocks', methods=['GET'])
+def syncClocks():
+    if request.method == 'GET':
+        report = controller.sync_clocks()
+        return jsonify(report)
+
+@app.route('/captureStatus', methods=['GET'])
+def captureStatus():
+    if request.method == 'GET':
+        report = controller.capture_status()
+        return jsonify(report)
+
+@app.route('/streamStatus', methods=['GET'])
+def streamStatus():
+    if request.method == 'GET':
+        report = controller.stream_status()
+        return jsonify(report)
+
+@app.route('/deliveryReport', methods=['GET'])
+def deliveryReport():
+    if request.method == 'GET':
+        report = controller.delivery_report()
+        return jsonify(report)
+
 @app.route('/recoverImages', methods=['GET'])
 def recoverImages():
     if request.method == 'GET':
-        controller.recover_images()
+        bulk = request.args.get('bulk', 'false') == 'true'
+        delete = request.args.get('delete', 'false') == 'true'
+        controller.recover_images(bulk=bulk, delete=delete)
         response = {"success": True}
         return jsonify(response)
 
+@app.route('/recoveryProgress', methods=['GET'])
+def recoveryProgress():
+    if request.method == 'GET':
+        report = controller.recovery_report
+        return jsonify(report)
+
 @app.route('/findCameras', methods=['POST'])
 def findCameras():
     if request.method == 'POST':
         data = request.json
         id = data['id']
         password = data['password']
-        cameras = controller.find_cameras(id=id, password=password)
+        discovery = data.get('discovery', 'hybrid')
+        cameras = controller.find_cameras(id=id, password=password, discovery=discovery)
         return jsonify(cameras)
 
+@app.route('/findCamerasStream', methods=['POST'])
+def findCamerasStream():
+    # Stream discovery events as newline-delimited JSON as each camera is found and becomes ready.
+    if request.method == 'POST':
+        data = request.json
+        id = data['id']
+        password = data['password']
+        discovery = data.get('discovery', 'hybrid')
+        events = controller.iter_cameras(id=id, password=password, discovery=discovery)
+        return Response((json.dumps(event) + "\n" for event in events), mimetype='application/x-ndjson')
+
 @app.route('/loadConfiguration', methods=['POST'])
 def loadConfiguration():
     if request.method == 'POST':
@@ -84,14 +179,6 @@ def clearConfiguration():
         cameras = controller.clear_configuration(configuration=configuration, id=id, password=password)
         return jsonify(cameras)
     
-@app.route('/cameraResponse', methods=['POST'])
-def cameraResponse():
-    if request.method == 'POST':
-        message = request.json
-        controller.message_buffer.put(message)
-        response = {"success": True}
-        return jsonify(response)
-
 @app.route('/logMessage', methods=['GET'])
 def logMessage():
     if request.method == 'GET':